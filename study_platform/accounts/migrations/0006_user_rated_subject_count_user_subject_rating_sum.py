@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_user_feedback_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rated_subject_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subject_rating_sum',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:03
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0006_user_rated_subject_count_user_subject_rating_sum'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('institute', '0003_institute_rated_teacher_count_and_more'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['institute', 'role', 'rating'], name='user_institute_role_rating_idx'),
+        ),
+    ]
@@ -22,6 +22,18 @@ class User(AbstractUser):
         default=0,
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)]
     )
+    subject_rating_sum = models.FloatField(default=0)
+    rated_subject_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['institute', 'role', 'rating'], name='user_institute_role_rating_idx'),
+        ]
 
     def __str__(self):
         return f'{self.first_name} {self.surname} {self.last_name}'
\ No newline at end of file
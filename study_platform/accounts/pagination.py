@@ -1,6 +1,138 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Model, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, page_size, ordering):
+        self.page_size = page_size
+        self.ordering = ordering
+
+    def get_ordering(self, queryset):
+        ordering = [
+            name for name in (queryset.query.order_by or queryset.model._meta.ordering)
+            if isinstance(name, str)
+        ] or list(self.ordering)
+        if not any(name.lstrip('-') in ('id', 'pk') for name in ordering):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        # Подделанный курсор не должен дойти до фильтра: значения приводим к типам полей сортировки
+        try:
+            return [self._to_python(name, value) for (name, _), value in zip(self.fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _to_python(self, name, value):
+        if value is None:
+            return None
+        model = self.model
+        try:
+            for part in name.split('__'):
+                field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+                model = field.related_model or model
+        except FieldDoesNotExist:
+            return value
+        value = field.to_python(value)
+        field.run_validators(value)
+        return value
+
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+    @staticmethod
+    def _value(obj, name):
+        for part in name.split('__'):
+            obj = getattr(obj, part, None)
+        return obj.pk if isinstance(obj, Model) else obj
+
+    def _after(self, position, values):
+        # NULL всегда в конце выборки, в обоих направлениях сортировки
+        equal = Q()
+        for (name, _), value in zip(self.fields[:position], values):
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        name, descending = self.fields[position]
+        value = values[position]
+        if value is None:
+            return None
+        after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value}) | Q(**{f'{name}__isnull': True})
+        return equal & after
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.get_ordering(queryset)]
+        queryset = queryset.order_by(*[
+            F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+            for name, descending in self.fields
+        ])
+
+        values = self.decode_cursor(request)
+        if values is not None:
+            conditions = [self._after(i, values) for i in range(len(self.fields))]
+            conditions = [condition for condition in conditions if condition is not None]
+            if not conditions:
+                self.page, self.has_next = [], False
+                return self.page
+            queryset = queryset.filter(reduce(or_, conditions))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self.encode_cursor([self._value(last, name) for name, _ in self.fields])
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
 
 class Pagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination(self.get_page_size(request) or self.page_size, self.ordering)
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
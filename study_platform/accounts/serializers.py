@@ -1,12 +1,14 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 
+from lessons.stars import RatingDistributionField
 from .models import User
 
 
 class UserSerializer(serializers.ModelSerializer):
 
     rating = serializers.FloatField(default=0.0, required=False)
+    rating_distribution = RatingDistributionField()
 
     class Meta:
         model = User
@@ -21,6 +23,7 @@ class UserSerializer(serializers.ModelSerializer):
             'rating',
             'password',
             'feedback_count',
+            'rating_distribution',
         ]
         extra_kwargs = {
             'password': {'write_only': True}
@@ -110,6 +113,8 @@ class ChangePasswordSerializer(serializers.Serializer):
 
 
 class UserListSerializer(serializers.ModelSerializer):
+    rating_distribution = RatingDistributionField()
+
     class Meta:
         model = User
         fields = ['id', 
@@ -118,4 +123,5 @@ class UserListSerializer(serializers.ModelSerializer):
                   'surname',
                   'role',
                   'rating',
+                  'rating_distribution',
                 ]
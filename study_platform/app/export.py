@@ -0,0 +1,103 @@
+import queue
+import threading
+import zlib
+
+from django.db import connection
+from django.db.models import F
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+COPY_OPTIONS = {
+    'csv': 'FORMAT csv, HEADER',
+    # В CSV-режиме с управляющими символами вместо кавычек и разделителя
+    # Postgres отдаёт JSON как есть, без экранирования обратных слешей
+    'ndjson': "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'",
+}
+QUEUE_SIZE = 64
+
+_DONE = object()
+
+
+def export_rows(feedbacks):
+    return feedbacks.order_by('id').values(
+        'id', 'created_at', 'student_name', 'rating', 'comment', 'praises',
+        'lesson_id', 'teacher_id', 'subject_id', 'institute_id',
+        lesson_topic=F('lesson__topic'),
+        lesson_start_time=F('lesson__start_time'),
+        teacher_first_name=F('teacher__first_name'),
+        teacher_surname=F('teacher__surname'),
+        teacher_last_name=F('teacher__last_name'),
+        subject_name=F('subject__name'),
+        institute_name=F('institute__name'),
+    )
+
+
+def copy_sql(rows, fmt):
+    sql, params = rows.query.sql_with_params()
+    connection.ensure_connection()
+    with connection.connection.cursor() as cursor:
+        select = cursor.mogrify(sql, params).decode()
+    if fmt == 'ndjson':
+        select = f'SELECT row_to_json(feedback) FROM ({select}) AS feedback'
+    return f'COPY ({select}) TO STDOUT WITH ({COPY_OPTIONS[fmt]})'
+
+
+class _QueueWriter:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.cancelled = threading.Event()
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write(self, data):
+        if not self.put(data):
+            raise OSError('Export cancelled by the client')
+
+
+def stream_copy(sql):
+    chunks = queue.Queue(maxsize=QUEUE_SIZE)
+    writer = _QueueWriter(chunks)
+    connection.ensure_connection()
+    raw_connection = connection.connection
+
+    def run():
+        try:
+            with raw_connection.cursor() as cursor:
+                cursor.copy_expert(sql, writer)
+        except Exception as exc:
+            result = exc
+        else:
+            result = _DONE
+        writer.put(result)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        writer.cancelled.set()
+        worker.join()
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,136 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+METRICS = ('total_ms', 'db_ms', 'queries', 'serializer_ms')
+PERCENTILES = (50, 90, 99)
+
+_current_timing = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+            f'serializer;dur={self.serializer_time * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}'
+        )
+
+
+def install_serializer_timing():
+    original = BaseSerializer.data
+    if getattr(original.fget, 'timed', False):
+        return
+
+    def data(self):
+        timing = _current_timing.get()
+        # Вложенные сериализаторы уже учтены во внешнем
+        if timing is None or timing.serializer_depth:
+            return original.fget(self)
+        timing.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            timing.serializer_time += time.perf_counter() - started
+            timing.serializer_depth -= 1
+
+    data.timed = True
+    BaseSerializer.data = property(data)
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return dict.fromkeys((f'p{percentile}' for percentile in PERCENTILES))
+    return {
+        f'p{percentile}': values[max(math.ceil(percentile * len(values) / 100), 1) - 1]
+        for percentile in PERCENTILES
+    }
+
+
+class RequestStats:
+    def __init__(self, window):
+        self.window = window
+        self._requests = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, sample):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(sample)
+            self._requests[name] = self._requests.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = {name: (self._requests[name], list(samples)) for name, samples in self._samples.items()}
+        return {
+            name: {
+                'requests': requests,
+                'window': len(samples),
+                **{
+                    metric: _percentiles(sample[index] for sample in samples)
+                    for index, metric in enumerate(METRICS)
+                },
+            }
+            for name, (requests, samples) in sorted(snapshot.items())
+        }
+
+
+request_stats = RequestStats(window=settings.REQUEST_STATS_WINDOW)
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_serializer_timing()
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                response = self.get_response(request)
+        finally:
+            _current_timing.reset(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = timing.server_timing(total)
+        match = request.resolver_match
+        if match is not None:
+            request_stats.record(match.view_name, (
+                round(total * 1000, 2),
+                round(timing.db_time * 1000, 2),
+                timing.queries,
+                round(timing.serializer_time * 1000, 2),
+            ))
+        return response
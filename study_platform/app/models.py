@@ -0,0 +1,38 @@
+import uuid
+
+from django.db import models
+
+from accounts.models import User
+
+
+class ReportJob(models.Model):
+    KIND_CHOICES = (
+        ('feedback', 'Feedback report'),
+        ('teacher', 'Teacher report'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict)
+    params_hash = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='report_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['params_hash', 'fingerprint'], name='report_job_reuse_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} report {self.id} ({self.status})'
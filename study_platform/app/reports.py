@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.timezone import localtime
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from accounts.models import User
+from institute.models import Institute
+from lessons.models import StudentFeedback
+from lessons.praises import teacher_top_praises
+from subjects.models import Subject
+from .models import ReportJob
+from .utils import filter_feedbacks, generate_excel_report, get_top_praises
+
+logger = logging.getLogger(__name__)
+
+
+def feedback_report_source(params):
+    entity, entity_type = None, None
+    if params.get('subject_id'):
+        entity = Subject.objects.filter(id=params['subject_id']).first()
+        entity_type = 'subject'
+    elif params.get('teacher_id'):
+        entity = User.objects.filter(id=params['teacher_id'], role='teacher').first()
+        entity_type = 'teacher'
+    elif params.get('institute_id'):
+        entity = Institute.objects.filter(id=params['institute_id']).first()
+        entity_type = 'institute'
+
+    feedbacks = filter_feedbacks(
+        StudentFeedback.objects.all(), params.get('start_date'), params.get('end_date'), entity_type, entity
+    )
+    return entity, entity_type, feedbacks
+
+
+def build_feedback_report(params):
+    entity, entity_type, feedbacks = feedback_report_source(params)
+    best_praise, worst_praise = get_top_praises(
+        params.get('start_date'), params.get('end_date'), entity_type, entity
+    )
+
+    report_data = [
+        entity.name if entity_type == 'institute' else '',
+        (f"{entity.first_name} {entity.surname}".strip()
+         if entity_type == 'teacher' else ''),
+        entity.rating if entity_type == 'teacher' else '',
+        entity.name if entity_type == 'subject' else '',
+        entity.rating if entity_type == 'subject' else '',
+        best_praise or '',
+        worst_praise or '',
+    ]
+    return generate_excel_report(feedbacks, report_data)
+
+
+def teacher_report_source(params):
+    teacher = User.objects.get(id=params['teacher_id'], role='teacher')
+    feedbacks = filter_feedbacks(
+        StudentFeedback.objects.filter(teacher=teacher),
+        params.get('start_date'), params.get('end_date'), None, None,
+    )
+    return teacher, 'teacher', feedbacks
+
+
+def build_teacher_report(params):
+    teacher, _, feedbacks = teacher_report_source(params)
+    start_date_str = params.get('start_date')
+    end_date_str = params.get('end_date')
+    if start_date_str or end_date_str:
+        most_frequent_praise, most_frequent_criticism = get_top_praises(
+            start_date_str, end_date_str, 'teacher', teacher
+        )
+    else:
+        most_frequent_praise, most_frequent_criticism = teacher_top_praises(teacher.id, 4)
+
+    institute_name = teacher.institute.name if teacher.institute else ''
+    total_reviews = teacher.feedback_count
+    rating = teacher.rating or 0.0
+
+    wb = Workbook()
+
+    ws1 = wb.active
+    ws1.title = "Основная информация"
+
+    ws1.append(["ФИО преподавателя", "Рейтинг", "Институт", "Топ 2 мини-отзыва", "Количество оценок"])
+
+    fio = f"{teacher.first_name or ''} {teacher.surname or ''} {teacher.last_name or ''}".strip()
+
+    top_reviews = []
+    if most_frequent_praise:
+        top_reviews.append(most_frequent_praise)
+    if most_frequent_criticism:
+        top_reviews.append(most_frequent_criticism)
+
+    row_values = [fio, rating, institute_name, ", ".join(top_reviews), total_reviews]
+    ws1.append(row_values)
+
+    ws1.delete_cols(4)
+    ws1.cell(row=1, column=4, value="Похвала")
+    ws1.cell(row=1, column=5, value="Критика")
+    ws1.cell(row=1, column=6, value="Количество оценок")
+
+    ws1.cell(row=2, column=1, value=fio)
+    ws1.cell(row=2, column=2, value=rating)
+    ws1.cell(row=2, column=3, value=institute_name)
+    ws1.cell(row=2, column=6, value=total_reviews)
+
+    praise_cell = ws1.cell(row=2, column=4, value=most_frequent_praise if most_frequent_praise else '')
+    criticism_cell = ws1.cell(row=2, column=5, value=most_frequent_criticism if most_frequent_criticism else '')
+
+    green_fill = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid')
+    red_fill = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
+
+    if most_frequent_praise:
+        praise_cell.fill = green_fill
+    if most_frequent_criticism:
+        criticism_cell.fill = red_fill
+
+    ws2 = wb.create_sheet("Отзывы")
+
+    # Добавляем ещё одну колонку после "Результат" для praises
+    ws2.append(["Студент", "Предмет", "Пара (Тема)", "Дата и время", "Комментарий", "Оценка", "Результат", "Praises"])
+
+    for fb in feedbacks.select_related('lesson', 'lesson__subject').iterator(chunk_size=2000):
+        dt = localtime(fb.created_at).strftime('%Y-%m-%d %H:%M:%S')
+        result_text = "Понравилось" if fb.rating >= 4 else "Не понравилось"
+        praises_str = ", ".join(fb.praises) if fb.praises else ''
+        ws2.append([
+            fb.student_name,
+            fb.lesson.subject.name if fb.lesson.subject else '',
+            fb.lesson.topic,
+            dt,
+            fb.comment,
+            fb.rating,
+            result_text,
+            praises_str
+        ])
+
+    return wb
+
+
+REPORTS = {
+    'feedback': (feedback_report_source, build_feedback_report),
+    'teacher': (teacher_report_source, build_teacher_report),
+}
+
+
+def report_filename(kind, params):
+    if kind == 'teacher':
+        return f"report_teacher_{params['teacher_id']}.xlsx"
+    return 'report.xlsx'
+
+
+def params_hash(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+
+def report_fingerprint(kind, params):
+    source, _ = REPORTS[kind]
+    entity, _, feedbacks = source(params)
+    stats = feedbacks.order_by().aggregate(count=Count('id'), last=Max('id'), updated=Max('updated_at'))
+    stamp = [stats['count'], stats['last'], stats['updated'], getattr(entity, 'rating', None)]
+    return hashlib.sha256(json.dumps(stamp, default=str).encode()).hexdigest()
+
+
+def find_or_create_report_job(kind, params, user):
+    digest = params_hash(kind, params)
+    fingerprint = report_fingerprint(kind, params)
+    # Зависшие задачи (упал воркер, потерялось сообщение) не должны блокировать отчёт навсегда
+    now = timezone.now()
+    ReportJob.objects.filter(
+        params_hash=digest,
+        status__in=['pending', 'running'],
+        created_at__lt=now - timedelta(minutes=settings.REPORT_JOB_TIMEOUT_MINUTES),
+    ).update(status='failed', error='Report job timed out.', finished_at=now)
+    job = ReportJob.objects.filter(
+        params_hash=digest, fingerprint=fingerprint
+    ).exclude(status='failed').order_by('-created_at').first()
+    if job is not None and (job.status != 'done' or os.path.exists(job.file_path)):
+        return job, False
+
+    job = ReportJob.objects.create(
+        kind=kind,
+        params=params,
+        params_hash=digest,
+        fingerprint=fingerprint,
+        created_by=user if user.is_authenticated else None,
+    )
+    return job, True
+
+
+def run_report_job(job_id):
+    if not ReportJob.objects.filter(pk=job_id, status='pending').update(status='running'):
+        return None
+    job = ReportJob.objects.get(pk=job_id)
+    path = Path(settings.REPORTS_ROOT) / f'{job.id}.xlsx'
+    try:
+        _, build = REPORTS[job.kind]
+        wb = build(job.params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix('.part')
+        wb.save(partial)
+        os.replace(partial, path)
+    except Exception as exc:
+        logger.exception('Report job %s failed', job.id)
+        job.status = 'failed'
+        job.error = str(exc)
+    else:
+        job.status = 'done'
+        job.file_path = str(path)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'file_path', 'finished_at'])
+    return job
+
+
+def purge_expired_reports():
+    expired = ReportJob.objects.filter(
+        created_at__lt=timezone.now() - timedelta(hours=settings.REPORT_RETENTION_HOURS)
+    ).exclude(status__in=['pending', 'running'])
+    removed = 0
+    for file_path in expired.exclude(file_path='').values_list('file_path', flat=True).iterator():
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        removed += 1
+    expired.delete()
+    return removed
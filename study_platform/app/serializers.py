@@ -0,0 +1,79 @@
+from django.urls import reverse
+from rest_framework import serializers
+
+from accounts.models import User
+from institute.models import Institute
+from lessons.rollups import ENTITY_KEYS, TREND_PERIODS
+from subjects.models import Subject
+from .models import ReportJob
+
+
+class ReportRequestSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=ReportJob.KIND_CHOICES)
+    institute_id = serializers.IntegerField(required=False)
+    teacher_id = serializers.IntegerField(required=False)
+    subject_id = serializers.IntegerField(required=False)
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data['kind'] == 'teacher' and not data.get('teacher_id'):
+            raise serializers.ValidationError('teacher_id is required for a teacher report.')
+        for name, queryset in (
+            ('subject_id', Subject.objects.all()),
+            ('teacher_id', User.objects.filter(role='teacher')),
+            ('institute_id', Institute.objects.all()),
+        ):
+            if data.get(name) and not queryset.filter(id=data[name]).exists():
+                raise serializers.ValidationError({name: 'Not found.'})
+        return data
+
+    def report_params(self):
+        return {
+            name: value.isoformat() if name.endswith('_date') else value
+            for name, value in self.validated_data.items()
+            if name != 'kind' and value is not None
+        }
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'params', 'status', 'error', 'created_at', 'finished_at', 'download_url']
+
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        url = reverse('report-job-download', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class RatingSearchRequestSerializer(serializers.Serializer):
+    subject_id = serializers.IntegerField(required=False)
+    teacher_id = serializers.IntegerField(required=False)
+    institute_id = serializers.IntegerField(required=False)
+
+
+class RatingTrendRequestSerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=list(TREND_PERIODS), default='day')
+    lesson_id = serializers.IntegerField(required=False)
+    subject_id = serializers.IntegerField(required=False)
+    teacher_id = serializers.IntegerField(required=False)
+    institute_id = serializers.IntegerField(required=False)
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        entities = [
+            (entity_type, data[f'{entity_type}_id'])
+            for entity_type in ENTITY_KEYS if data.get(f'{entity_type}_id')
+        ]
+        if not entities:
+            raise serializers.ValidationError(
+                'One of lesson_id, subject_id, teacher_id or institute_id is required.'
+            )
+        data['entity_type'], data['entity_id'] = entities[0]
+        return data
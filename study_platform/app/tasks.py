@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from .reports import purge_expired_reports as purge_reports
+from .reports import run_report_job
+
+
+@shared_task
+def generate_report(job_id):
+    run_report_job(job_id)
+
+
+@shared_task
+def purge_expired_reports():
+    return purge_reports()
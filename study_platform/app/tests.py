@@ -0,0 +1,341 @@
+import base64
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from institute.models import Institute
+from lessons.ingest import ingest_feedbacks
+from lessons.models import Lesson, StudentFeedback
+from lessons.rollups import rebuild_daily_ratings
+from lessons.versions import get_versions
+from subjects.models import Subject
+from .export import gzip_stream
+from .middleware import RequestStats
+from .models import ReportJob
+from .reports import run_report_job
+
+
+class RatingSearchTest(TestCase):
+    url = '/api/rating/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=cls.institute, surname='Teacher')
+        cls.subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=cls.institute, subject=cls.subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def feed(self, *ratings):
+        # Версии поднимаются в on_commit, а TestCase не коммитит
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_feedbacks([
+                {'lesson': self.lesson.pk, 'student_name': f'Student {index}', 'rating': rating}
+                for index, rating in enumerate(ratings)
+            ])
+
+    def test_equivalent_ids_share_cache_entry(self):
+        self.feed(4)
+        response = self.client.get(self.url, {'subject_id': str(self.subject.pk)})
+        self.assertEqual(response.data['rating'], 4.0)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, {'subject_id': f'0{self.subject.pk}'})
+        self.assertEqual(cached.data, response.data)
+
+    def test_invalid_id_is_rejected(self):
+        response = self.client.get(self.url, {'teacher_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('teacher_id', response.data)
+
+    def test_lesson_leaderboard_of_teacher(self):
+        self.feed(5, 3)
+        response = self.client.get(self.url, {'teacher_id': self.teacher.pk})
+        self.assertEqual(response.data['top3'], [{'id': self.lesson.pk, 'name': 'Lesson', 'rating': 4.0}])
+        self.assertEqual(response.data['bottom3'], response.data['top3'])
+
+    def test_feedback_refreshes_cached_results(self):
+        self.feed(4)
+        self.client.get(self.url, {'subject_id': self.subject.pk})
+        self.client.get(self.url, {'institute_id': self.institute.pk})
+        self.feed(2)
+        subject = self.client.get(self.url, {'subject_id': self.subject.pk}).data
+        self.assertEqual((subject['rating'], subject['rating_distribution']['stars']['2']), (3.0, 1))
+        institute = self.client.get(self.url, {'institute_id': self.institute.pk}).data
+        self.assertEqual(institute['rating_distribution']['stars'], {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0})
+
+    def test_unrelated_lesson_save_keeps_versions(self):
+        self.feed(4)
+        self.lesson.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            versions = get_versions('subject', self.subject.pk), get_versions('teacher', self.teacher.pk)
+            self.lesson.end_time += timedelta(minutes=10)
+            self.lesson.save()
+        self.assertEqual(
+            (get_versions('subject', self.subject.pk), get_versions('teacher', self.teacher.pk)), versions
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.topic = 'Renamed'
+            self.lesson.save()
+        self.assertNotEqual(get_versions('subject', self.subject.pk), versions[0])
+
+
+class RatingTrendTest(TestCase):
+    url = '/api/rating/trend/'
+
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def test_daily_buckets_follow_feedback(self):
+        ingest_feedbacks([
+            {'lesson': self.lesson.pk, 'student_name': f'Student {index}', 'rating': rating}
+            for index, rating in enumerate((5, 4, 1))
+        ])
+        StudentFeedback.objects.filter(rating=1).update(created_at=timezone.now() - timedelta(days=40))
+        rebuild_daily_ratings()
+
+        response = self.client.get(self.url, {'teacher_id': self.teacher.pk})
+        self.assertEqual(response.data['entity_type'], 'teacher')
+        self.assertEqual(
+            [(bucket['feedback_count'], bucket['average_rating']) for bucket in response.data['buckets']],
+            [(1, 1.0), (2, 4.5)],
+        )
+        self.assertEqual(response.data['buckets'][1]['stars']['5'], 1)
+
+        recent = self.client.get(self.url, {
+            'lesson_id': self.lesson.pk, 'period': 'month',
+            'start_date': (timezone.localdate() - timedelta(days=7)).isoformat(),
+        })
+        self.assertEqual([bucket['feedback_count'] for bucket in recent.data['buckets']], [2])
+
+    def test_entity_is_required(self):
+        response = self.client.get(self.url, {'period': 'week'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'teacher_id': 1, 'period': 'year'}).status_code, 400)
+
+class FeedbackKeysetPaginationTest(TestCase):
+    url = '/api/feedback/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        StudentFeedback.objects.bulk_create([
+            StudentFeedback(
+                lesson=lesson, teacher=cls.teacher, subject=subject, institute=institute,
+                student_name=f'Student {index}', rating=5,
+            )
+            for index in range(7)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    @staticmethod
+    def cursor(values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_cursor_walks_all_feedback(self):
+        seen = []
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 3})
+        while True:
+            seen.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        expected = StudentFeedback.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_tampered_cursor_is_not_found(self):
+        for cursor in ('not base64!', self.cursor(['yesterday', 1]), self.cursor([None, 10 ** 30]), self.cursor([1])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 404)
+
+
+class ReportJobTest(TestCase):
+    url = '/api/reports/'
+
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        ingest_feedbacks([{'lesson': cls.lesson.pk, 'student_name': 'Student', 'rating': 5}])
+
+    def setUp(self):
+        self.enterContext(override_settings(REPORTS_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def request_report(self):
+        with patch('app.views.generate_report.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'kind': 'teacher', 'teacher_id': self.teacher.pk}, format='json')
+        return response, delay
+
+    def test_identical_requests_share_one_job(self):
+        first, delay = self.request_report()
+        self.assertEqual(first.status_code, 202)
+        delay.assert_called_once_with(first.data['id'])
+
+        second, delay = self.request_report()
+        self.assertEqual(second.data['id'], first.data['id'])
+        delay.assert_not_called()
+
+    def test_finished_report_is_reused_until_feedback_changes(self):
+        job_id = self.request_report()[0].data['id']
+        self.assertEqual(run_report_job(job_id).status, 'done')
+
+        response, delay = self.request_report()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], job_id)
+        download = self.client.get(response.data['download_url'])
+        self.assertEqual(download.status_code, 200)
+        download.close()
+
+        ingest_feedbacks([{'lesson': self.lesson.pk, 'student_name': 'Late', 'rating': 3}])
+        response, delay = self.request_report()
+        self.assertNotEqual(response.data['id'], job_id)
+        delay.assert_called_once()
+
+    def test_stale_job_is_failed_and_replaced(self):
+        job_id = self.request_report()[0].data['id']
+        ReportJob.objects.filter(pk=job_id).update(created_at=timezone.now() - timedelta(days=1))
+        response, delay = self.request_report()
+        self.assertNotEqual(response.data['id'], job_id)
+        self.assertEqual(ReportJob.objects.get(pk=job_id).status, 'failed')
+        self.assertIsNone(run_report_job(job_id))
+
+    def test_unknown_entity_is_rejected(self):
+        response = self.client.post(self.url, {'kind': 'feedback', 'subject_id': 999}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('subject_id', response.data)
+        self.assertFalse(ReportJob.objects.exists())
+
+
+class FeedbackExportTest(TestCase):
+    url = '/api/feedback/export/'
+
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.admin = User.objects.create(username='admin', is_staff=True, institute=institute)
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        ingest_feedbacks([
+            {'lesson': lesson.pk, 'student_name': 'Student, "quoted"', 'rating': 5, 'comment': 'back\\slash'},
+            {'lesson': lesson.pk, 'student_name': 'Second', 'rating': 3},
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_export_requires_admin(self):
+        self.client.force_authenticate(self.teacher)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, 400)
+
+    def test_gzip_stream_round_trip(self):
+        chunks = [b'first,row\n', b'', b'second,row\n']
+        self.assertEqual(gzip.decompress(b''.join(gzip_stream(iter(chunks)))), b''.join(chunks))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Export streams rows with COPY')
+    def test_ndjson_export_matches_feedback(self):
+        response = self.client.get(self.url, {'output': 'ndjson', 'compress': 'gzip'})
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['student_name'] for row in rows], ['Student, "quoted"', 'Second'])
+        self.assertEqual(rows[0]['comment'], 'back\\slash')
+        self.assertEqual(rows[0]['teacher_surname'], 'Teacher')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Export streams rows with COPY')
+    def test_csv_export_has_header_and_rows(self):
+        response = self.client.get(self.url)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,created_at,student_name'))
+        self.assertEqual(len(lines), 3)
+
+
+class RequestTimingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.institute = Institute.objects.create(name='Institute')
+        cls.admin = User.objects.create(username='admin', is_staff=True, institute=cls.institute)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/feedback/list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_stats_report_requests_per_view(self):
+        self.client.get('/api/feedback/list/')
+        stats = self.client.get('/api/stats/').data
+        self.assertGreaterEqual(stats['requests']['filtered-feedback-list']['requests'], 1)
+        self.assertIn('p99', stats['requests']['filtered-feedback-list']['queries'])
+        self.assertIn('rating_updates', stats)
+
+        self.client.force_authenticate(User.objects.create(username='teacher', role='teacher', institute=self.institute))
+        self.assertEqual(self.client.get('/api/stats/').status_code, 403)
+
+    def test_percentiles_keep_a_bounded_window(self):
+        stats = RequestStats(window=10)
+        for value in range(1, 21):
+            stats.record('view', (value, 0, 0, 0))
+        view = stats.stats()['view']
+        self.assertEqual((view['requests'], view['window']), (20, 10))
+        self.assertEqual(view['total_ms'], {'p50': 15, 'p90': 19, 'p99': 20})
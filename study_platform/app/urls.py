@@ -1,6 +1,16 @@
 from django.urls import path, include
 
-from .views import RatingSearchView, FilteredFeedbackListView, ReportExcelView
+from .views import (
+    FeedbackExportView,
+    FilteredFeedbackListView,
+    RatingSearchView,
+    RatingTrendView,
+    ReportExcelView,
+    ReportJobCreateView,
+    ReportJobDetailView,
+    ReportJobDownloadView,
+    StatsView,
+)
 
 urlpatterns = [
     path('api/accounts/', include('accounts.urls')),
@@ -8,6 +18,12 @@ urlpatterns = [
     path('api/lessons/', include(('lessons.urls', 'lessons'), namespace='lessons')),
     path('api/institutes/', include('institute.urls')),
     path('api/rating/search/', RatingSearchView.as_view(), name='rating-search'),
+    path('api/rating/trend/', RatingTrendView.as_view(), name='rating-trend'),
     path('api/feedback/list/', FilteredFeedbackListView.as_view(), name='filtered-feedback-list'),
+    path('api/feedback/export/', FeedbackExportView.as_view(), name='feedback-export'),
     path('api/report/excel/', ReportExcelView.as_view(), name='report-excel'),
+    path('api/reports/', ReportJobCreateView.as_view(), name='report-job-create'),
+    path('api/reports/<uuid:pk>/', ReportJobDetailView.as_view(), name='report-job-detail'),
+    path('api/reports/<uuid:pk>/download/', ReportJobDownloadView.as_view(), name='report-job-download'),
+    path('api/stats/', StatsView.as_view(), name='stats'),
 ]
@@ -1,40 +1,54 @@
+import tempfile
 from openpyxl import Workbook
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 
+from django.http import FileResponse
 from django.utils.timezone import get_current_timezone, make_aware
 from django.db.models import Q
 
 from accounts.models import User
-from lessons.models import StudentFeedback, Lesson
+from lessons.leaderboards import leaderboard
+from lessons.models import StudentFeedback
+from lessons.praises import praise_counts, top_praises
 from subjects.models import Subject
 from institute.models import Institute
 
-def filter_feedbacks(feedbacks, start_date_str, end_date_str, entity_type, entity):
+def date_range(start_date, end_date, field='created_at'):
     tz = get_current_timezone()
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
-        start_datetime = make_aware(datetime.combine(start_date, time.min), timezone=tz)
-        feedbacks = feedbacks.filter(created_at__gte=start_datetime)
+    bounds = Q()
+    if start_date:
+        bounds &= Q(**{f'{field}__gte': make_aware(datetime.combine(start_date, time.min), timezone=tz)})
+    if end_date:
+        end = end_date + timedelta(days=1)
+        bounds &= Q(**{f'{field}__lt': make_aware(datetime.combine(end, time.min), timezone=tz)})
+    return bounds
+
 
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
-        end_datetime = make_aware(datetime.combine(end_date, time.max), timezone=tz)
-        feedbacks = feedbacks.filter(created_at__lte=end_datetime)
+def filter_feedbacks(feedbacks, start_date_str, end_date_str, entity_type, entity):
+    start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+    end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    feedbacks = feedbacks.filter(date_range(start_date, end_date))
 
     if entity_type == 'subject':
-        feedbacks = feedbacks.filter(lesson__subject=entity)
+        feedbacks = feedbacks.filter(subject=entity)
     elif entity_type == 'teacher':
-        feedbacks = feedbacks.filter(lesson__teacher=entity)
+        feedbacks = feedbacks.filter(teacher=entity)
     elif entity_type == 'institute':
-        feedbacks = feedbacks.filter(lesson__institute=entity)
+        feedbacks = feedbacks.filter(institute=entity)
     return feedbacks
 
 
-def generate_excel_report(feedbacks, report_data):
-    wb = Workbook()
+def get_top_praises(start_date_str, end_date_str, entity_type, entity, good_from=4):
+    feedbacks = filter_feedbacks(
+        StudentFeedback.objects.all(), start_date_str, end_date_str, entity_type, entity
+    )
+    return top_praises(praise_counts(feedbacks), good_from)
+
+
+def generate_excel_report(feedbacks, report_data, chunk_size=2000):
+    wb = Workbook(write_only=True)
 
-    ws1 = wb.active
-    ws1.title = 'Основная информация'
+    ws1 = wb.create_sheet('Основная информация')
     ws1.append([
         'Институт', 'Преподаватель', 'Оценка преподавателя',
         'Предмет', 'Оценка предмета', 'Лучший отзыв', 'Худший отзыв'
@@ -47,20 +61,37 @@ def generate_excel_report(feedbacks, report_data):
         'Комментарий', 'Преподаватель', 'Институт', 'Дата и время'
     ])
 
-    for fb in feedbacks:
+    tz = get_current_timezone()
+    rows = feedbacks.order_by('created_at', 'id').values_list(
+        'student_name', 'rating', 'praises', 'comment',
+        'teacher__first_name', 'teacher__surname', 'institute__name', 'created_at',
+    ).iterator(chunk_size=chunk_size)
+    for student_name, rating, praises, comment, first_name, surname, institute, created_at in rows:
         ws2.append([
-            fb.student_name,
-            fb.rating,
-            ', '.join(fb.praises) if fb.praises else '',
-            fb.comment or '',
-            (f"{fb.lesson.teacher.first_name} {fb.lesson.teacher.surname}".strip()
-             if fb.lesson and fb.lesson.teacher else ''),
-            fb.lesson.institute.name if fb.lesson.institute else '',
-            fb.created_at.astimezone(get_current_timezone()).strftime('%Y-%m-%d %H:%M:%S')
+            student_name,
+            rating,
+            ', '.join(praises) if praises else '',
+            comment or '',
+            f"{first_name or ''} {surname or ''}".strip(),
+            institute or '',
+            created_at.astimezone(tz).strftime('%Y-%m-%d %H:%M:%S')
         ])
 
     return wb
 
+
+def excel_response(wb, filename):
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
 def get_entity_and_feedbacks(institute_id, teacher_id, subject_id):
     feedbacks = StudentFeedback.objects.all()
     entity, entity_type, rating = None, None, None
@@ -70,62 +101,38 @@ def get_entity_and_feedbacks(institute_id, teacher_id, subject_id):
         entity = Subject.objects.filter(id=subject_id).first()
         if entity:
             rating = entity.rating
-            feedbacks = feedbacks.filter(lesson__subject=entity)
+            feedbacks = feedbacks.filter(subject=entity)
     elif teacher_id:
         entity_type = 'teacher'
         entity = User.objects.filter(id=teacher_id, role='teacher').first()
         if entity:
             rating = entity.rating
-            feedbacks = feedbacks.filter(lesson__teacher=entity)
+            feedbacks = feedbacks.filter(teacher=entity)
     elif institute_id:
         entity_type = 'institute'
         entity = Institute.objects.filter(id=institute_id).first()
         if entity:
             rating = entity.rating
-            feedbacks = feedbacks.filter(lesson__institute=entity)
+            feedbacks = feedbacks.filter(institute=entity)
 
     return entity, entity_type, rating, feedbacks
 
 
-def get_lesson_ratings(entity, filter_by):
-    lessons = Lesson.objects.filter(**filter_by).exclude(
-        Q(average_rating__isnull=True) | Q(average_rating=0)
-    )
-    best_lessons = lessons.order_by('-average_rating')[:3]
-    worst_lessons = lessons.order_by('average_rating')[:3]
-
-    return [
-        {'id': l.id, 'name': l.topic, 'rating': l.average_rating}
-        for l in best_lessons
-    ], [
-        {'id': l.id, 'name': l.topic, 'rating': l.average_rating}
-        for l in worst_lessons
-    ]
-
-
-def get_teacher_ratings(entity):
-    teachers = User.objects.filter(
-        institute=entity, role='teacher'
-    ).exclude(Q(rating__isnull=True) | Q(rating=0))
-
-    best_teachers = teachers.order_by('-rating')[:3]
-    worst_teachers = teachers.order_by('rating')[:3]
-
-    def fill_to_three(items):
-        arr = [
-            {
-                'id': t.id,
-                'name': f'{t.first_name} {t.surname} {t.last_name or ""}'.strip(),
-                'rating': t.rating,
-            }
-            for t in items
-        ]
-        while len(arr) < 3:
+def get_lesson_ratings(scope_type, scope_id, limit=3):
+    return leaderboard(scope_type, scope_id, limit)
+
+
+def get_teacher_ratings(entity, limit=3):
+    best_teachers, worst_teachers = leaderboard('institute', entity.pk, limit)
+
+    def fill_to_limit(items):
+        arr = list(items)
+        while len(arr) < limit:
             arr.append(None)
         return arr
 
-    top3 = fill_to_three(best_teachers)
-    bottom3 = fill_to_three(worst_teachers)
+    top3 = fill_to_limit(best_teachers)
+    bottom3 = fill_to_limit(worst_teachers)
 
     top_ids = {x['id'] for x in top3 if x}
     for i, item in enumerate(bottom3):
@@ -1,40 +1,89 @@
-from io import BytesIO
-
-from rest_framework import generics
+from rest_framework import generics, status
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils.dateparse import parse_date
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.utils.timezone import make_aware, get_current_timezone
 from datetime import datetime, time
 from openpyxl import Workbook
-from django.http import HttpResponse
 
 from subjects.models import Subject
 from accounts.models import User
+from accounts.pagination import Pagination
 from lessons.models import Lesson, StudentFeedback
 from institute.models import Institute
+from lessons.rollups import rating_trend
 from lessons.serializers import StudentFeedbackSerializer
+from lessons.stars import STAR_FIELDS, rating_distribution
+from lessons.admission import feedback_admission
+from lessons.cache import lesson_code_cache
+from lessons.ratings import rating_update_stats
+from lessons.versions import get_versions
+from .export import EXPORT_FORMATS, copy_sql, export_rows, gzip_stream, stream_copy
+from .middleware import request_stats
+from .models import ReportJob
+from .permissions import IsAdminUser
+from .reports import build_feedback_report, feedback_report_source, find_or_create_report_job, report_filename
+from .serializers import (
+    RatingSearchRequestSerializer,
+    RatingTrendRequestSerializer,
+    ReportJobSerializer,
+    ReportRequestSerializer,
+)
+from .tasks import generate_report
 from .utils import (
-        filter_feedbacks,
-        generate_excel_report,
+        date_range,
+        excel_response,
         get_entity_and_feedbacks,
         get_lesson_ratings,
         get_teacher_ratings,
     )
 
+def institute_distribution(institute_id):
+    # Звёзды института меняются с каждым отзывом, а версию института поднимают только рейтинги преподавателей,
+    # поэтому распределение не кешируем и читаем из строки института — один запрос по ключу
+    institute = Institute.objects.filter(id=institute_id).only(*STAR_FIELDS).first()
+    return rating_distribution(institute) if institute else None
+
+
 class RatingSearchView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        institute_id = request.query_params.get('institute_id')
-        teacher_id = request.query_params.get('teacher_id')
-        subject_id = request.query_params.get('subject_id')
+        # Идентификаторы приводим к int, чтобы "05" и "5" попадали в одну запись кеша
+        serializer = RatingSearchRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        institute_id = serializer.validated_data.get('institute_id')
+        teacher_id = serializer.validated_data.get('teacher_id')
+        subject_id = serializer.validated_data.get('subject_id')
+        try:
+            limit = int(request.query_params.get('limit', 3))
+        except ValueError:
+            limit = 3
+        limit = min(max(limit, 1), settings.LEADERBOARD_SIZE)
+
+        cache_key = None
+        for entity_type, entity_id in (('subject', subject_id), ('teacher', teacher_id), ('institute', institute_id)):
+            if entity_id:
+                global_version, version = get_versions(entity_type, entity_id)
+                cache_key = f'rating_search:{entity_type}:{entity_id}:{limit}:{global_version}:{version}'
+                break
+        if cache_key is not None:
+            data = cache.get(cache_key)
+            if data is not None:
+                if entity_type == 'institute':
+                    data['rating_distribution'] = institute_distribution(entity_id)
+                return Response(data)
 
         data = {
             "rating": None,
+            "rating_distribution": None,
             "top3": [],
             "bottom3": []
         }
@@ -43,26 +92,42 @@ class RatingSearchView(APIView):
             institute_id, teacher_id, subject_id
         )
         data["rating"] = rating
+        if entity:
+            data["rating_distribution"] = rating_distribution(entity)
 
-        if entity_type == 'subject' and entity:
-            top3, bottom3 = get_lesson_ratings(entity, {'subject': entity})
-            data["top3"], data["bottom3"] = top3, bottom3
-
-        elif entity_type == 'teacher' and entity:
-            top3, bottom3 = get_lesson_ratings(entity, {'teacher': entity})
+        if entity_type in ('subject', 'teacher') and entity:
+            top3, bottom3 = get_lesson_ratings(entity_type, entity.pk, limit)
             data["top3"], data["bottom3"] = top3, bottom3
 
         elif entity_type == 'institute' and entity:
-            top3, bottom3 = get_teacher_ratings(entity)
+            top3, bottom3 = get_teacher_ratings(entity, limit)
             data["top3"], data["bottom3"] = top3, bottom3
 
+        if cache_key is not None:
+            cache.set(cache_key, data, timeout=settings.RATING_SEARCH_CACHE_TTL)
         return Response(data)
     
 
-class FeedbackPagination(PageNumberPagination):
-    page_size = 5
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+class RatingTrendView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = RatingTrendRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        return Response({
+            "entity_type": params['entity_type'],
+            "entity_id": params['entity_id'],
+            "period": params['period'],
+            "buckets": rating_trend(
+                params['entity_type'], params['entity_id'], params['period'],
+                params.get('start_date'), params.get('end_date'),
+            ),
+        })
+
+
+class FeedbackPagination(Pagination):
+    ordering = ('-created_at', '-id')
 
 class FilteredFeedbackListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
@@ -79,69 +144,104 @@ class FilteredFeedbackListView(generics.ListAPIView):
         feedbacks = StudentFeedback.objects.all()
 
         if subject_id:
-            feedbacks = feedbacks.filter(lesson__subject_id=subject_id)
+            feedbacks = feedbacks.filter(subject_id=subject_id)
         elif teacher_id:
-            feedbacks = feedbacks.filter(lesson__teacher_id=teacher_id)
+            feedbacks = feedbacks.filter(teacher_id=teacher_id)
         elif institute_id:
-            feedbacks = feedbacks.filter(lesson__institute_id=institute_id)
-
-        if start_date_str:
-            start_date = parse_date(start_date_str)
-            if start_date:
-                feedbacks = feedbacks.filter(created_at__date__gte=start_date)
-        if end_date_str:
-            end_date = parse_date(end_date_str)
-            if end_date:
-                feedbacks = feedbacks.filter(created_at__date__lte=end_date)
-
-        return feedbacks.order_by('-created_at')
+            feedbacks = feedbacks.filter(institute_id=institute_id)
+
+        start_date = parse_date(start_date_str) if start_date_str else None
+        end_date = parse_date(end_date_str) if end_date_str else None
+        feedbacks = feedbacks.filter(date_range(start_date, end_date))
+
+        return feedbacks.order_by('-created_at', '-id')
     
 
 class ReportExcelView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        institute_id = request.query_params.get('institute_id')
-        teacher_id = request.query_params.get('teacher_id')
-        subject_id = request.query_params.get('subject_id')
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
+        serializer = ReportRequestSerializer(data={**request.query_params.dict(), 'kind': 'feedback'})
+        serializer.is_valid(raise_exception=True)
+        wb = build_feedback_report(serializer.report_params())
+        return excel_response(wb, report_filename('feedback', {}))
 
-        feedbacks = StudentFeedback.objects.all()
-        entity, entity_type = None, None
 
-        if subject_id:
-            entity = Subject.objects.filter(id=subject_id).first()
-            entity_type = 'subject'
-        elif teacher_id:
-            entity = User.objects.filter(id=teacher_id, role='teacher').first()
-            entity_type = 'teacher'
-        elif institute_id:
-            entity = Institute.objects.filter(id=institute_id).first()
-            entity_type = 'institute'
-
-        feedbacks = filter_feedbacks(feedbacks, start_date_str, end_date_str, entity_type, entity)
-
-        report_data = [
-            entity.name if entity_type == 'institute' else '',
-            (f"{entity.first_name} {entity.surname}".strip()
-             if entity_type == 'teacher' else ''),
-            entity.rating if entity_type == 'teacher' else '',
-            entity.name if entity_type == 'subject' else '',
-            entity.rating if entity_type == 'subject' else '',
-            '',
-            '',
-        ]
-
-        wb = generate_excel_report(feedbacks, report_data)
-
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        response = HttpResponse(
-            output,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+class ReportJobCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = ReportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        kind = serializer.validated_data['kind']
+        job, created = find_or_create_report_job(kind, serializer.report_params(), request.user)
+        if created:
+            transaction.on_commit(lambda: generate_report.delay(str(job.id)))
+        return Response(
+            ReportJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED if job.status != 'done' else status.HTTP_200_OK,
         )
-        response['Content-Disposition'] = 'attachment; filename="report.xlsx"'
-        return response
\ No newline at end of file
+
+
+class ReportJobDetailView(generics.RetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ReportJobSerializer
+    queryset = ReportJob.objects.all()
+
+
+class ReportJobDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(ReportJob, pk=pk)
+        if job.status != 'done':
+            return Response(
+                {"error": "Report is not ready yet.", "status": job.status},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            report = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            return Response({"error": "Report file has expired."}, status=status.HTTP_410_GONE)
+        return FileResponse(
+            report,
+            as_attachment=True,
+            filename=report_filename(job.kind, job.params),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+
+class FeedbackExportView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        fmt = request.query_params.get('output', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported output format. Use one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = ReportRequestSerializer(data={**request.query_params.dict(), 'kind': 'feedback'})
+        serializer.is_valid(raise_exception=True)
+        _, _, feedbacks = feedback_report_source(serializer.report_params())
+
+        content_type, extension = EXPORT_FORMATS[fmt]
+        chunks = stream_copy(copy_sql(export_rows(feedbacks), fmt))
+        if request.query_params.get('compress') == 'gzip':
+            chunks = gzip_stream(chunks)
+            content_type, extension = 'application/gzip', f'{extension}.gz'
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="feedback.{extension}"'
+        return response
+
+
+class StatsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'rating_updates': rating_update_stats(),
+            'lesson_code_cache': lesson_code_cache.stats(),
+            'feedback_admission': feedback_admission.stats(),
+            'requests': request_stats.stats(),
+        })
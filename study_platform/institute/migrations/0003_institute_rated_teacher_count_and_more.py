@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('institute', '0002_alter_institute_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='institute',
+            name='rated_teacher_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='institute',
+            name='teacher_rating_sum',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('institute', '0003_institute_rated_teacher_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='institute',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='institute',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='institute',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='institute',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='institute',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
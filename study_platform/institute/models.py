@@ -10,3 +10,10 @@ class Institute(models.Model):
         default=0,
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)]
     )
+    teacher_rating_sum = models.FloatField(default=0)
+    rated_teacher_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
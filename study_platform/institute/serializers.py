@@ -1,9 +1,12 @@
 from rest_framework import serializers
 
+from lessons.stars import RatingDistributionField
 from .models import Institute
 
 
 class InstituteSerializer(serializers.ModelSerializer):
+    rating_distribution = RatingDistributionField()
+
     class Meta:
         model = Institute
-        fields = ["id", "name", "rating"]
+        fields = ["id", "name", "rating", "rating_distribution"]
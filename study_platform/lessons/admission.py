@@ -0,0 +1,145 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+ADMITTED = 'admitted'
+DUPLICATE = 'duplicate'
+FLOOD = 'flood'
+
+
+def client_address(request):
+    address = request.META.get('REMOTE_ADDR', '')
+    if address not in settings.TRUSTED_PROXIES:
+        return address
+    # Идём по цепочке справа налево: первый адрес не из доверенных прокси и есть клиент
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if hop not in settings.TRUSTED_PROXIES:
+            break
+    return address
+
+
+def client_fingerprint(request):
+    address = client_address(request)
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    return hashlib.blake2b(f'{address}|{user_agent}'.encode(), digest_size=8).hexdigest()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+
+class TokenBuckets:
+    def __init__(self, burst, per_minute, max_size):
+        self.burst = burst
+        self.refill_rate = per_minute / 60
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def tokens(self, key, now):
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated_at) * self.refill_rate)
+
+    def store(self, key, tokens, now):
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+
+
+class FeedbackAdmission:
+    def __init__(self, class_size, per_minute, client_burst, client_per_minute,
+                 seen_capacity, seen_error_rate, max_lessons):
+        # Своя корзина у каждого клиента урока, чтобы один клиент не выбрал лимит за всю группу;
+        # общая корзина урока шире и только ограничивает суммарный поток
+        self._lessons = TokenBuckets(class_size, per_minute, max_lessons)
+        self._clients = TokenBuckets(client_burst, client_per_minute, max_lessons * class_size)
+        self.retry_after = math.ceil(60 / min(per_minute, client_per_minute))
+        self.seen_capacity = seen_capacity
+        self.seen_error_rate = seen_error_rate
+        self.max_lessons = max_lessons
+        self.counters = {ADMITTED: 0, DUPLICATE: 0, FLOOD: 0}
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seen_key(client, student_name):
+        return f'{client}|{str(student_name).strip().lower()}'
+
+    def _evict(self, entries, limit):
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def _take_token(self, lesson_id, client, now):
+        buckets = ((self._clients, (lesson_id, client)), (self._lessons, lesson_id))
+        tokens = [bucket.tokens(key, now) for bucket, key in buckets]
+        # Жетон списываем из обеих корзин только если есть в обеих, иначе отказ съест чужой лимит
+        allowed = all(count >= 1 for count in tokens)
+        for (bucket, key), count in zip(buckets, tokens):
+            bucket.store(key, count - 1 if allowed else count, now)
+        return allowed
+
+    def admit(self, lesson_id, client, student_name):
+        with self._lock:
+            seen = self._seen.get(lesson_id)
+            if seen is not None and self._seen_key(client, student_name) in seen:
+                verdict = DUPLICATE
+            elif not self._take_token(lesson_id, client, time.monotonic()):
+                verdict = FLOOD
+            else:
+                verdict = ADMITTED
+            self.counters[verdict] += 1
+            return verdict
+
+    def remember(self, lesson_id, client, student_name):
+        with self._lock:
+            seen = self._seen.get(lesson_id)
+            if seen is None:
+                seen = self._seen[lesson_id] = BloomFilter(self.seen_capacity, self.seen_error_rate)
+            self._seen.move_to_end(lesson_id)
+            self._evict(self._seen, self.max_lessons)
+            seen.add(self._seen_key(client, student_name))
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'tracked_lessons': len(self._seen),
+                'rate_limited_lessons': len(self._lessons),
+                'rate_limited_clients': len(self._clients),
+            }
+
+
+feedback_admission = FeedbackAdmission(
+    class_size=settings.FEEDBACK_CLASS_SIZE,
+    per_minute=settings.FEEDBACK_RATE_PER_MINUTE,
+    client_burst=settings.FEEDBACK_CLIENT_BURST,
+    client_per_minute=settings.FEEDBACK_CLIENT_RATE_PER_MINUTE,
+    seen_capacity=settings.FEEDBACK_SEEN_CAPACITY,
+    seen_error_rate=settings.FEEDBACK_SEEN_ERROR_RATE,
+    max_lessons=settings.FEEDBACK_ADMISSION_MAX_LESSONS,
+)
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Lesson
+
+
+class LessonWindow(NamedTuple):
+    id: int
+    is_active: bool
+    start_time: datetime
+    end_time: datetime
+
+    def is_link_active(self):
+        if not self.is_active:
+            return False
+        return self.start_time <= timezone.now() <= self.end_time
+
+
+class LessonCodeCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, unique_code):
+        row = Lesson.objects.filter(unique_code=unique_code).values_list(
+            'id', 'is_active', 'start_time', 'end_time'
+        ).first()
+        return LessonWindow(*row) if row else None
+
+    def get(self, unique_code):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(unique_code)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(unique_code)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        window = self._load(unique_code)
+        with self._lock:
+            self._entries[unique_code] = (now + self.ttl, window, None)
+            self._entries.move_to_end(unique_code)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return window
+
+    def get_data(self, unique_code, build):
+        # Сериализованный урок живёт столько же, сколько закешированное окно
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(unique_code)
+            if entry is not None and entry[0] > now and entry[2] is not None:
+                return entry[2]
+
+        data = build()
+        with self._lock:
+            entry = self._entries.get(unique_code)
+            if entry is not None and entry[0] > now:
+                self._entries[unique_code] = (entry[0], entry[1], data)
+        return data
+
+    def invalidate(self, unique_code):
+        with self._lock:
+            self._entries.pop(unique_code, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+lesson_code_cache = LessonCodeCache(
+    maxsize=settings.LESSON_CODE_CACHE_SIZE,
+    ttl=settings.LESSON_CODE_CACHE_TTL,
+)
+
+
+def get_lesson_window(unique_code):
+    # Неактивному окну тоже доверяем до истечения TTL: продление в другом воркере станет видно не позже чем через ttl секунд
+    return lesson_code_cache.get(unique_code)
@@ -0,0 +1,139 @@
+import logging
+import time
+from collections import defaultdict
+
+from celery import current_app
+from django.db import DataError, IntegrityError, transaction
+from kombu import Exchange, Queue
+
+from .models import Lesson, StudentFeedback
+from .ratings import record_feedbacks
+from .serializers import StudentFeedbackInputSerializer
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_EXCHANGE = Exchange('feedback')
+FEEDBACK_QUEUE = Queue('feedback', FEEDBACK_EXCHANGE, routing_key='feedback')
+FEEDBACK_DEAD_LETTER_QUEUE = Queue('feedback.dead', FEEDBACK_EXCHANGE, routing_key='feedback.dead')
+
+
+def _store(entries):
+    with transaction.atomic():
+        StudentFeedback.objects.bulk_create(
+            [feedback for lesson_entries in entries.values() for feedback, _ in lesson_entries]
+        )
+        record_feedbacks({
+            lesson_id: [feedback for feedback, _ in lesson_entries]
+            for lesson_id, lesson_entries in entries.items()
+        })
+
+
+def ingest_feedbacks(items, check_window=True):
+    rejected = []
+    by_lesson = defaultdict(list)
+    for item in items:
+        data = dict(item)
+        lesson_id = data.pop('lesson', None)
+        # Отзывы из спула уже прошли проверку окна при приёме
+        window_checked = data.pop('window_checked', False)
+        serializer = StudentFeedbackInputSerializer(data=data)
+        if lesson_id is None or not serializer.is_valid():
+            logger.warning('Rejecting malformed feedback: %r', item)
+            rejected.append((item, 'invalid' if lesson_id is not None else 'no lesson'))
+            continue
+        by_lesson[lesson_id].append((serializer.validated_data, item, window_checked))
+
+    lessons = Lesson.objects.in_bulk(list(by_lesson))
+    entries = defaultdict(list)
+    for lesson_id in sorted(lessons):
+        lesson = lessons[lesson_id]
+        link_active = lesson.is_link_active()
+        for data, item, window_checked in by_lesson[lesson_id]:
+            if check_window and not window_checked and not link_active:
+                continue
+            entries[lesson_id].append((StudentFeedback(
+                lesson=lesson,
+                teacher_id=lesson.teacher_id,
+                subject_id=lesson.subject_id,
+                institute_id=lesson.institute_id,
+                **data,
+            ), item))
+
+    try:
+        _store(entries)
+    except (DataError, IntegrityError):
+        # Одна плохая строка не должна блокировать весь батч: вставляем по одной
+        logger.exception('Batch insert of feedback failed, retrying row by row')
+        for lesson_id, lesson_entries in entries.items():
+            for feedback, item in lesson_entries:
+                feedback.pk = None
+                try:
+                    _store({lesson_id: [(feedback, item)]})
+                except (DataError, IntegrityError) as exc:
+                    feedback.pk = None
+                    rejected.append((item, str(exc)))
+
+    feedbacks = {
+        lesson_id: [feedback for feedback, _ in lesson_entries if feedback.pk is not None]
+        for lesson_id, lesson_entries in entries.items()
+    }
+    return feedbacks, rejected
+
+
+def publish_feedback(feedback_data, queue=FEEDBACK_QUEUE):
+    with current_app.producer_or_acquire() as producer:
+        producer.publish(
+            feedback_data,
+            exchange=queue.exchange,
+            routing_key=queue.routing_key,
+            declare=[queue],
+            serializer='json',
+            delivery_mode='persistent',
+        )
+
+
+def publish_dead_letters(rejected):
+    for payload, error in rejected:
+        publish_feedback({'payload': payload, 'error': error}, queue=FEEDBACK_DEAD_LETTER_QUEUE)
+
+
+def _collect(queue, batch_size, max_wait):
+    messages = []
+    deadline = None
+    while len(messages) < batch_size:
+        timeout = 1.0 if deadline is None else deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            messages.append(queue.get(block=True, timeout=timeout))
+        except queue.Empty:
+            if deadline is not None:
+                break
+            continue
+        if deadline is None:
+            deadline = time.monotonic() + max_wait
+    return messages
+
+
+def consume_feedback(batch_size, max_wait):
+    with current_app.connection_for_read() as connection:
+        queue = connection.SimpleQueue(FEEDBACK_QUEUE)
+        queue.consumer.qos(prefetch_count=batch_size)
+        while True:
+            messages = _collect(queue, batch_size, max_wait)
+            try:
+                feedbacks, rejected = ingest_feedbacks([message.payload for message in messages])
+                publish_dead_letters(rejected)
+            except Exception:
+                # Сюда попадают только временные сбои (БД или брокер недоступны), плохие строки уходят в DLQ
+                logger.exception('Failed to ingest a batch of %s feedbacks', len(messages))
+                for message in messages:
+                    message.requeue()
+                time.sleep(max_wait)
+                continue
+            for message in messages:
+                message.ack()
+            logger.info(
+                'Ingested %s feedbacks for %s lessons from %s messages, %s dead-lettered',
+                sum(len(items) for items in feedbacks.values()), len(feedbacks), len(messages), len(rejected),
+            )
@@ -0,0 +1,184 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from accounts.models import User
+from .models import LeaderboardEntry, LeaderboardScope, Lesson
+
+SIDES = ('top', 'bottom')
+NAME_FIELDS = {
+    'subject': ('topic',),
+    'teacher': ('topic',),
+    'institute': ('first_name', 'surname', 'last_name'),
+}
+
+
+def _members(scope_type):
+    if scope_type == 'institute':
+        return User.objects.filter(role='teacher', rating__gt=0), 'institute_id', 'rating'
+    return Lesson.objects.filter(average_rating__gt=0), f'{scope_type}_id', 'average_rating'
+
+
+def member_name(scope_type, member):
+    if scope_type == 'institute':
+        return f'{member.first_name} {member.surname} {member.last_name or ""}'.strip()
+    return member.topic
+
+
+def _ordering(rating_field, side):
+    rating = F(rating_field).desc() if side == 'top' else F(rating_field).asc()
+    return [rating, F('id').asc()]
+
+
+def _sort_key(side, rating, member_id):
+    return (-rating if side == 'top' else rating, member_id)
+
+
+def _entry_key(entry):
+    return _sort_key(entry.side, entry.rating, entry.member_id)
+
+
+def _entries(scope_type, side, members, partition, rating_field):
+    return [
+        LeaderboardEntry(
+            scope_type=scope_type,
+            scope_id=getattr(member, partition),
+            side=side,
+            member_id=member.pk,
+            name=member_name(scope_type, member),
+            rating=getattr(member, rating_field),
+        )
+        for member in members
+    ]
+
+
+def _refill(scope_type, scope_id, side):
+    LeaderboardEntry.objects.filter(scope_type=scope_type, scope_id=scope_id, side=side).delete()
+    members, partition, rating_field = _members(scope_type)
+    best = members.filter(**{partition: scope_id}).only(
+        'id', partition, rating_field, *NAME_FIELDS[scope_type]
+    ).order_by(*_ordering(rating_field, side))[:settings.LEADERBOARD_SIZE]
+    return LeaderboardEntry.objects.bulk_create(_entries(scope_type, side, best, partition, rating_field))
+
+
+def _refill_side(scope_type, scope_id, side, entries):
+    entries[:] = [entry for entry in entries if entry.side != side] + _refill(scope_type, scope_id, side)
+
+
+def _lock_scope(scope_type, scope_id):
+    # Upsert держит блокировку строки области до конца транзакции; сам владелец доски не блокируется
+    table = LeaderboardScope._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (scope_type, scope_id) VALUES (%s, %s) '
+            f'ON CONFLICT (scope_type, scope_id) DO UPDATE SET scope_id = EXCLUDED.scope_id',
+            [scope_type, scope_id],
+        )
+
+
+def _update_board(scope_type, scope_id, entries, member_id, name, rating):
+    size = settings.LEADERBOARD_SIZE
+    rated = bool(rating and rating > 0)
+
+    for side in SIDES:
+        board = [entry for entry in entries if entry.side == side]
+        current = next((entry for entry in board if entry.member_id == member_id), None)
+
+        if current is None:
+            if not rated:
+                continue
+            if len(board) >= size:
+                last = max(board, key=_entry_key)
+                if _sort_key(side, rating, member_id) >= _entry_key(last):
+                    continue
+                last.delete()
+                entries.remove(last)
+            entries.append(LeaderboardEntry.objects.create(
+                scope_type=scope_type, scope_id=scope_id, side=side,
+                member_id=member_id, name=name, rating=rating,
+            ))
+            continue
+
+        others = [entry for entry in board if entry is not current]
+        # Неполная доска содержит всех участников с оценками, полную при выбывании добираем из источника
+        if not rated:
+            if len(board) >= size:
+                _refill_side(scope_type, scope_id, side, entries)
+            else:
+                current.delete()
+                entries.remove(current)
+        elif len(board) >= size and others and _sort_key(side, rating, member_id) > max(map(_entry_key, others)):
+            _refill_side(scope_type, scope_id, side, entries)
+        elif current.rating != rating or current.name != name:
+            current.rating, current.name = rating, name
+            current.save(update_fields=['rating', 'name'])
+
+
+@transaction.atomic
+def update_members(scope_type, scope_id, members):
+    if scope_id is None:
+        return
+    _lock_scope(scope_type, scope_id)
+    # Доску области читаем один раз на всех участников батча
+    entries = list(LeaderboardEntry.objects.filter(scope_type=scope_type, scope_id=scope_id))
+    for member_id, name, rating in members:
+        _update_board(scope_type, scope_id, entries, member_id, name, rating)
+
+
+def update_member(scope_type, scope_id, member_id, name=None, rating=None):
+    update_members(scope_type, scope_id, [(member_id, name, rating)])
+
+
+def remove_member(scope_type, scope_id, member_id):
+    update_member(scope_type, scope_id, member_id)
+
+
+def drop_stale_scopes(scope_type, member_id, scope_id):
+    stale = LeaderboardEntry.objects.filter(
+        scope_type=scope_type, member_id=member_id
+    ).exclude(scope_id=scope_id).values_list('scope_id', flat=True).distinct()
+    for stale_id in list(stale):
+        remove_member(scope_type, stale_id, member_id)
+
+
+def rebuild_leaderboards(scopes=None):
+    if scopes is None:
+        scopes = {scope_type: None for scope_type, _ in LeaderboardEntry.SCOPE_CHOICES}
+    created = 0
+    with transaction.atomic():
+        for scope_type, scope_ids in scopes.items():
+            entries = LeaderboardEntry.objects.filter(scope_type=scope_type)
+            members, partition, rating_field = _members(scope_type)
+            if scope_ids is not None:
+                entries = entries.filter(scope_id__in=scope_ids)
+                members = members.filter(**{f'{partition}__in': scope_ids})
+            entries.delete()
+            for side in SIDES:
+                ranked = members.annotate(position=Window(
+                    RowNumber(), partition_by=F(partition), order_by=_ordering(rating_field, side),
+                )).filter(position__lte=settings.LEADERBOARD_SIZE).only(
+                    'id', partition, rating_field, *NAME_FIELDS[scope_type]
+                )
+                rows = _entries(scope_type, side, ranked.iterator(chunk_size=2000), partition, rating_field)
+                LeaderboardEntry.objects.bulk_create(rows, batch_size=2000)
+                created += len(rows)
+    return created
+
+
+def drop_scope(scope_type, scope_id):
+    LeaderboardEntry.objects.filter(scope_type=scope_type, scope_id=scope_id).delete()
+    LeaderboardScope.objects.filter(scope_type=scope_type, scope_id=scope_id).delete()
+
+
+def leaderboard(scope_type, scope_id, limit):
+    boards = {side: [] for side in SIDES}
+    for entry in LeaderboardEntry.objects.filter(scope_type=scope_type, scope_id=scope_id):
+        boards[entry.side].append(entry)
+    return tuple(
+        [
+            {'id': entry.member_id, 'name': entry.name, 'rating': entry.rating}
+            for entry in sorted(boards[side], key=_entry_key)[:limit]
+        ]
+        for side in SIDES
+    )
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import User
+from app.utils import date_range, filter_feedbacks
+from lessons.models import LeaderboardEntry, Lesson, StudentFeedback
+
+
+def hot_queries(lesson_id, teacher_id, subject_id, institute_id):
+    today = timezone.localdate()
+    last_week = date_range(today - timedelta(days=7), today)
+    return {
+        'feedback list by date': StudentFeedback.objects.filter(last_week).order_by('-created_at', '-id')[:20],
+        'feedback of lesson by date': StudentFeedback.objects.filter(
+            last_week, lesson_id=lesson_id
+        ).order_by('-created_at'),
+        'feedback of teacher by date': filter_feedbacks(
+            StudentFeedback.objects.all(),
+            (today - timedelta(days=7)).isoformat(), today.isoformat(), 'teacher', teacher_id,
+        ),
+        'teacher lessons by start time': Lesson.objects.filter(teacher_id=teacher_id).order_by('-start_time')[:20],
+        'teacher lessons by rating': Lesson.objects.filter(teacher_id=teacher_id).order_by('-average_rating')[:20],
+        'best lessons of subject': Lesson.objects.filter(
+            subject_id=subject_id, average_rating__gt=0
+        ).order_by('-average_rating')[:3],
+        'best lessons of institute': Lesson.objects.filter(
+            institute_id=institute_id, average_rating__gt=0
+        ).order_by('-average_rating')[:3],
+        'best teachers of institute': User.objects.filter(
+            institute_id=institute_id, role='teacher', rating__gt=0
+        ).order_by('-rating')[:3],
+        'leaderboard of subject': LeaderboardEntry.objects.filter(scope_type='subject', scope_id=subject_id),
+    }
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN hot feedback and lesson queries and fail if any of them needs a sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans can only be checked on PostgreSQL')
+
+        lesson = Lesson.objects.values('id', 'teacher_id', 'subject_id', 'institute_id').first() or {}
+        queries = hot_queries(
+            lesson.get('id', 0), lesson.get('teacher_id', 0),
+            lesson.get('subject_id', 0), lesson.get('institute_id', 0),
+        )
+
+        regressions = []
+        for name, queryset in queries.items():
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    # Без seq scan планировщик вынужден взять индекс, если он подходит
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            if options['verbose_plans']:
+                self.stdout.write(f'{name}:\n{plan}\n')
+            if 'Seq Scan' in plan:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: sequential scan\n{plan}'))
+            else:
+                self.stdout.write(f'{name}: ok')
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} hot queries fall back to a sequential scan')
+        self.stdout.write(self.style.SUCCESS(f'All {len(queries)} hot queries use indexes'))
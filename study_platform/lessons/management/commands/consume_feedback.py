@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lessons.ingest import consume_feedback
+
+
+class Command(BaseCommand):
+    help = 'Consume the feedback queue and insert feedback in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.FEEDBACK_BATCH_SIZE)
+        parser.add_argument('--max-wait-ms', type=int, default=settings.FEEDBACK_BATCH_MAX_WAIT_MS)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Consuming feedback in batches of up to {options['batch_size']} messages "
+            f"or {options['max_wait_ms']} ms"
+        )
+        consume_feedback(options['batch_size'], options['max_wait_ms'] / 1000)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lessons.spool import drain_spool, feedback_spool
+
+
+class Command(BaseCommand):
+    help = 'Forward spooled feedback to the database or the broker in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.FEEDBACK_BATCH_SIZE)
+        parser.add_argument(
+            '--target', choices=['database', 'broker'], default=settings.FEEDBACK_SPOOL_TARGET
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Draining {feedback_spool.path} to the {options['target']} "
+            f"in batches of up to {options['batch_size']} entries"
+        )
+        drain_spool(feedback_spool, options['batch_size'], options['target'])
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lessons.rollups import ENTITY_KEYS, rebuild_daily_ratings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-day rating rollups of lessons, subjects, teachers and institutes from stored feedback'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity', choices=list(ENTITY_KEYS), help='Only rebuild rollups of this entity type')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = rebuild_daily_ratings(options['entity'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} daily rollups in {time.monotonic() - started:.3f}s'
+        ))
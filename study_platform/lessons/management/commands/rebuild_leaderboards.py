@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lessons.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild top and bottom leaderboards of subjects, teachers and institutes from current ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scope', choices=['subject', 'teacher', 'institute'], help='Only rebuild boards of this scope type'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scopes = {options['scope']: None} if options['scope'] else None
+        rows = rebuild_leaderboards(scopes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} leaderboard entries in {time.monotonic() - started:.3f}s'
+        ))
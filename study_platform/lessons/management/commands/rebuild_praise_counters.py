@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lessons.praises import rebuild_praise_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-teacher praise and criticism counters from stored feedback'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teacher', type=int, help='Only rebuild counters of this teacher')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = rebuild_praise_counters(options['teacher'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} counters in {time.monotonic() - started:.3f}s'
+        ))
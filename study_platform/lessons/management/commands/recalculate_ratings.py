@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from lessons.ratings import bulk_recompute
+from lessons.tasks import recalculate_all_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recalculate lesson, subject, teacher and institute ratings in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institute', type=int, help='Only recalculate ratings affected by this institute')
+        parser.add_argument(
+            '--async', action='store_true', dest='use_celery',
+            help='Enqueue the recalculation as a Celery task',
+        )
+
+    def handle(self, *args, **options):
+        institute_id = options['institute']
+        if options['use_celery']:
+            result = recalculate_all_ratings.delay(institute_id)
+            self.stdout.write(f'Enqueued task {result.id}')
+            return
+
+        total = 0
+        for level, rows, seconds in bulk_recompute(institute_id):
+            total += seconds
+            self.stdout.write(f'{level}: {rows} rows in {seconds:.3f}s')
+        self.stdout.write(self.style.SUCCESS(f'Done in {total:.3f}s'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0011_remove_lesson_activation_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+from django.db.models import Count, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+
+
+def _aggregate(queryset, group_field, value_field):
+    return queryset.filter(**{group_field: OuterRef('pk')}).order_by().values(group_field).annotate(
+        total=Sum(value_field),
+        count=Count('id'),
+    )
+
+
+def _update(queryset, rows, sum_field, count_field, rating_field, empty_rating):
+    queryset.update(**{
+        sum_field: Coalesce(Subquery(rows.values('total')), 0, output_field=queryset.model._meta.get_field(sum_field)),
+        count_field: Coalesce(Subquery(rows.values('count')), 0),
+    })
+    queryset.filter(**{f'{count_field}__gt': 0}).update(**{
+        rating_field: Cast(sum_field, FloatField()) / Cast(count_field, FloatField()),
+    })
+    queryset.filter(**{count_field: 0}).update(**{rating_field: empty_rating})
+
+
+def backfill_rating_sums(apps, schema_editor):
+    StudentFeedback = apps.get_model('lessons', 'StudentFeedback')
+    Lesson = apps.get_model('lessons', 'Lesson')
+    Subject = apps.get_model('subjects', 'Subject')
+    User = apps.get_model('accounts', 'User')
+    Institute = apps.get_model('institute', 'Institute')
+
+    _update(
+        Lesson.objects.all(),
+        _aggregate(StudentFeedback.objects.filter(rating__gt=0), 'lesson', 'rating'),
+        'rating_sum', 'feedback_count', 'average_rating', None,
+    )
+    _update(
+        Subject.objects.all(),
+        _aggregate(Lesson.objects.filter(average_rating__gt=0), 'subject', 'average_rating'),
+        'lesson_rating_sum', 'rated_lesson_count', 'rating', 0,
+    )
+    _update(
+        User.objects.filter(role='teacher'),
+        _aggregate(Subject.objects.filter(rating__gt=0), 'teacher', 'rating'),
+        'subject_rating_sum', 'rated_subject_count', 'rating', 0,
+    )
+    _update(
+        Institute.objects.all(),
+        _aggregate(User.objects.filter(role='teacher', rating__gt=0), 'institute', 'rating'),
+        'teacher_rating_sum', 'rated_teacher_count', 'rating', 0,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0012_lesson_rating_sum'),
+        ('subjects', '0003_subject_lesson_rating_sum_subject_rated_lesson_count'),
+        ('accounts', '0006_user_rated_subject_count_user_subject_rating_sum'),
+        ('institute', '0003_institute_rated_teacher_count_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rating_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0013_backfill_rating_sums'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(choices=[('lesson', 'Lesson'), ('subject', 'Subject'), ('teacher', 'Teacher'), ('institute', 'Institute')], max_length=10)),
+                ('entity_id', models.BigIntegerField()),
+                ('marked_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id'), name='unique_dirty_rating')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+from collections import Counter
+
+from django.db import migrations
+
+
+def backfill_praise_counters(apps, schema_editor):
+    StudentFeedback = apps.get_model('lessons', 'StudentFeedback')
+    TeacherPraiseCounter = apps.get_model('lessons', 'TeacherPraiseCounter')
+
+    counts = Counter()
+    rows = StudentFeedback.objects.exclude(praises=[]).values_list(
+        'lesson__teacher_id', 'rating', 'praises'
+    ).iterator(chunk_size=2000)
+    for teacher_id, rating, praises in rows:
+        for praise in praises or []:
+            counts[teacher_id, str(praise)[:255], int(rating or 0)] += 1
+
+    TeacherPraiseCounter.objects.bulk_create(
+        [
+            TeacherPraiseCounter(teacher_id=teacher_id, praise=praise, rating=rating, count=count)
+            for (teacher_id, praise, rating), count in counts.items()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0015_teacherpraisecounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_praise_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:00
+
+import base64
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_qr_images(apps, schema_editor):
+    from django.conf import settings
+
+    from lessons.qr import feedback_form_url, render_qr
+
+    Lesson = apps.get_model('lessons', 'Lesson')
+    LessonQRCode = apps.get_model('lessons', 'LessonQRCode')
+
+    # Старые картинки вели на API-адрес отправки отзыва, поэтому перерисовываем их по адресу формы
+    batch = []
+    rows = Lesson.objects.exclude(qr_code_base64__isnull=True).exclude(qr_code_base64='').values_list(
+        'id', 'unique_code'
+    ).iterator(chunk_size=500)
+    for lesson_id, unique_code in rows:
+        image = render_qr(feedback_form_url(unique_code), 'png', settings.QR_DEFAULT_SIZE)
+        batch.append(LessonQRCode(lesson_id=lesson_id, image=image))
+        if len(batch) >= 500:
+            LessonQRCode.objects.bulk_create(batch)
+            batch = []
+    LessonQRCode.objects.bulk_create(batch)
+
+
+def restore_qr_images(apps, schema_editor):
+    Lesson = apps.get_model('lessons', 'Lesson')
+    LessonQRCode = apps.get_model('lessons', 'LessonQRCode')
+
+    for qr_code in LessonQRCode.objects.iterator(chunk_size=500):
+        Lesson.objects.filter(pk=qr_code.lesson_id).update(
+            qr_code_base64=base64.b64encode(bytes(qr_code.image)).decode('utf-8')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0016_backfill_praise_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonQRCode',
+            fields=[
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='qr_code', serialize=False, to='lessons.lesson')),
+                ('image', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(move_qr_images, restore_qr_images),
+        migrations.RemoveField(
+            model_name='lesson',
+            name='qr_code_base64',
+        ),
+    ]
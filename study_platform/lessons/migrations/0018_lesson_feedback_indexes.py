@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:03
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('institute', '0003_institute_rated_teacher_count_and_more'),
+        ('lessons', '0017_lessonqrcode_move_qr_images'),
+        ('subjects', '0003_subject_lesson_rating_sum_subject_rated_lesson_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(fields=['teacher', '-start_time'], name='lesson_teacher_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(fields=['teacher', '-average_rating'], name='lesson_teacher_rating_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(condition=models.Q(('average_rating__gt', 0)), fields=['subject', 'average_rating'], name='lesson_subject_rated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(condition=models.Q(('average_rating__gt', 0)), fields=['institute', 'average_rating'], name='lesson_institute_rated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='studentfeedback',
+            index=models.Index(fields=['lesson', '-created_at'], name='feedback_lesson_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='studentfeedback',
+            index=models.Index(fields=['-created_at', '-id'], name='feedback_created_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('institute', '0003_institute_rated_teacher_count_and_more'),
+        ('lessons', '0018_lesson_feedback_indexes'),
+        ('subjects', '0003_subject_lesson_rating_sum_subject_rated_lesson_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentfeedback',
+            name='institute',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='institute.institute'),
+        ),
+        migrations.AddField(
+            model_name='studentfeedback',
+            name='subject',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='subjects.subject'),
+        ),
+        migrations.AddField(
+            model_name='studentfeedback',
+            name='teacher',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE lessons_studentfeedback AS feedback
+            SET teacher_id = lesson.teacher_id,
+                subject_id = lesson.subject_id,
+                institute_id = lesson.institute_id
+            FROM lessons_lesson AS lesson
+            WHERE feedback.lesson_id = lesson.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
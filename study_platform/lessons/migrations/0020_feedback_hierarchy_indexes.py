@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:04
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('lessons', '0019_studentfeedback_hierarchy'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='studentfeedback',
+            index=models.Index(fields=['teacher', '-created_at'], include=('rating',), name='feedback_teacher_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='studentfeedback',
+            index=models.Index(fields=['subject', '-created_at'], include=('rating',), name='feedback_subject_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='studentfeedback',
+            index=models.Index(fields=['institute', '-created_at'], include=('rating',), name='feedback_institute_created_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def backfill_leaderboards(apps, schema_editor):
+    Lesson = apps.get_model('lessons', 'Lesson')
+    User = apps.get_model('accounts', 'User')
+    LeaderboardEntry = apps.get_model('lessons', 'LeaderboardEntry')
+
+    boards = (
+        ('subject', Lesson.objects.filter(average_rating__gt=0), 'subject_id', 'average_rating'),
+        ('teacher', Lesson.objects.filter(average_rating__gt=0), 'teacher_id', 'average_rating'),
+        ('institute', User.objects.filter(role='teacher', rating__gt=0), 'institute_id', 'rating'),
+    )
+    for scope_type, members, partition, rating_field in boards:
+        for side in ('top', 'bottom'):
+            rating = F(rating_field).desc() if side == 'top' else F(rating_field).asc()
+            ranked = members.annotate(position=Window(
+                RowNumber(), partition_by=F(partition), order_by=[rating, F('id').asc()],
+            )).filter(position__lte=settings.LEADERBOARD_SIZE)
+            LeaderboardEntry.objects.bulk_create(
+                [
+                    LeaderboardEntry(
+                        scope_type=scope_type,
+                        scope_id=getattr(member, partition),
+                        side=side,
+                        member_id=member.pk,
+                        name=(
+                            f'{member.first_name} {member.surname} {member.last_name or ""}'.strip()
+                            if scope_type == 'institute' else member.topic
+                        ),
+                        rating=getattr(member, rating_field),
+                    )
+                    for member in ranked.iterator(chunk_size=2000)
+                ],
+                batch_size=2000,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_user_rating_indexes'),
+        ('lessons', '0020_feedback_hierarchy_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope_type', models.CharField(choices=[('subject', 'Lessons of subject'), ('teacher', 'Lessons of teacher'), ('institute', 'Teachers of institute')], max_length=10)),
+                ('scope_id', models.BigIntegerField()),
+                ('side', models.CharField(choices=[('top', 'Top'), ('bottom', 'Bottom')], max_length=6)),
+                ('member_id', models.BigIntegerField()),
+                ('name', models.TextField()),
+                ('rating', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope_type', 'member_id'], name='leaderboard_member_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope_type', 'scope_id', 'side', 'member_id'), name='unique_leaderboard_member')],
+            },
+        ),
+        migrations.RunPython(backfill_leaderboards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:14
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_ratings(apps, schema_editor):
+    StudentFeedback = apps.get_model('lessons', 'StudentFeedback')
+    DailyRating = apps.get_model('lessons', 'DailyRating')
+
+    for entity_type in ('lesson', 'subject', 'teacher', 'institute'):
+        key = f'{entity_type}_id'
+        rows = StudentFeedback.objects.filter(rating__gt=0, **{f'{key}__isnull': False}).annotate(
+            day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()),
+        ).order_by().values(key, 'day').annotate(
+            total=Count('id'),
+            total_rating=Sum('rating'),
+            **{f'total_stars_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+        ).iterator(chunk_size=2000)
+        DailyRating.objects.bulk_create(
+            [
+                DailyRating(
+                    entity_type=entity_type,
+                    entity_id=row[key],
+                    day=row['day'],
+                    feedback_count=row['total'],
+                    rating_sum=row['total_rating'],
+                    **{f'stars_{star}': row[f'total_stars_{star}'] for star in range(1, 6)},
+                )
+                for row in rows
+            ],
+            batch_size=2000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0021_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(choices=[('lesson', 'Lesson'), ('subject', 'Subject'), ('teacher', 'Teacher'), ('institute', 'Institute')], max_length=10)),
+                ('entity_id', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('feedback_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id', 'day'), name='unique_daily_rating')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_ratings, migrations.RunPython.noop),
+    ]
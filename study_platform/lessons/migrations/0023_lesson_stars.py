@@ -0,0 +1,60 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+def backfill_stars_sql(table, key):
+    stars = range(1, 6)
+    return f"""
+        UPDATE {table} AS entity
+        SET {', '.join(f'stars_{star} = counts.stars_{star}' for star in stars)}
+        FROM (
+            SELECT {key}, {', '.join(f'COUNT(*) FILTER (WHERE rating = {star}) AS stars_{star}' for star in stars)}
+            FROM lessons_studentfeedback
+            WHERE {key} IS NOT NULL
+            GROUP BY {key}
+        ) AS counts
+        WHERE entity.id = counts.{key}
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_user_stars'),
+        ('institute', '0004_institute_stars'),
+        ('lessons', '0022_dailyrating'),
+        ('subjects', '0004_subject_stars'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(backfill_stars_sql('lessons_lesson', 'lesson_id'), migrations.RunSQL.noop),
+        migrations.RunSQL(backfill_stars_sql('subjects_subject', 'subject_id'), migrations.RunSQL.noop),
+        migrations.RunSQL(backfill_stars_sql('accounts_user', 'teacher_id'), migrations.RunSQL.noop),
+        migrations.RunSQL(backfill_stars_sql('institute_institute', 'institute_id'), migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0023_lesson_stars'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentfeedback',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
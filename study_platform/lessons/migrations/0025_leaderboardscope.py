@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0024_studentfeedback_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardScope',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope_type', models.CharField(choices=[('subject', 'Lessons of subject'), ('teacher', 'Lessons of teacher'), ('institute', 'Teachers of institute')], max_length=10)),
+                ('scope_id', models.BigIntegerField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scope_type', 'scope_id'), name='unique_leaderboard_scope')],
+            },
+        ),
+    ]
@@ -21,14 +21,35 @@ class Lesson(models.Model):
     unique_code = models.UUIDField(default=uuid.uuid4, unique=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now, editable=False)
-    qr_code_base64 = models.TextField(null=True, blank=True)
     feedback_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
     average_rating = models.FloatField(
         null=True,
         verbose_name='Рейтинг предмета',
         default=0,
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)]
     )
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['teacher', '-start_time'], name='lesson_teacher_start_idx'),
+            models.Index(fields=['teacher', '-average_rating'], name='lesson_teacher_rating_idx'),
+            models.Index(
+                fields=['subject', 'average_rating'],
+                name='lesson_subject_rated_idx',
+                condition=models.Q(average_rating__gt=0),
+            ),
+            models.Index(
+                fields=['institute', 'average_rating'],
+                name='lesson_institute_rated_idx',
+                condition=models.Q(average_rating__gt=0),
+            ),
+        ]
 
     def get_unique_link(self):
         return f'/lesson/{self.unique_code}/'
@@ -42,6 +63,17 @@ class Lesson(models.Model):
         return f'Lesson: {self.topic} by {self.teacher}'
 
 
+class LessonQRCode(models.Model):
+    lesson = models.OneToOneField(
+        Lesson, on_delete=models.CASCADE, primary_key=True, related_name='qr_code'
+    )
+    image = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'QR code for lesson #{self.lesson_id}'
+
+
 class FormLink(models.Model):
     token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -54,11 +86,156 @@ class FormLink(models.Model):
 
 class StudentFeedback(models.Model):
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE)
+    # Копия иерархии урока, чтобы фильтровать отзывы без JOIN через Lesson
+    teacher = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, editable=False, db_index=False, related_name='+'
+    )
+    subject = models.ForeignKey(
+        Subject, on_delete=models.CASCADE, null=True, editable=False, db_index=False, related_name='+'
+    )
+    institute = models.ForeignKey(
+        Institute, on_delete=models.CASCADE, null=True, editable=False, db_index=False, related_name='+'
+    )
     student_name = models.CharField(max_length=255)
     rating = models.PositiveSmallIntegerField()
     comment = models.TextField(blank=True)
     praises = models.JSONField(default=list)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lesson', '-created_at'], name='feedback_lesson_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='feedback_created_idx'),
+            models.Index(fields=['teacher', '-created_at'], include=['rating'], name='feedback_teacher_created_idx'),
+            models.Index(fields=['subject', '-created_at'], include=['rating'], name='feedback_subject_created_idx'),
+            models.Index(
+                fields=['institute', '-created_at'], include=['rating'], name='feedback_institute_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'Feedback by {self.student_name} for {self.lesson}'
+
+
+class DailyRating(models.Model):
+    ENTITY_CHOICES = (
+        ('lesson', 'Lesson'),
+        ('subject', 'Subject'),
+        ('teacher', 'Teacher'),
+        ('institute', 'Institute'),
+    )
+
+    entity_type = models.CharField(max_length=10, choices=ENTITY_CHOICES)
+    entity_id = models.BigIntegerField()
+    day = models.DateField()
+    feedback_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity_type', 'entity_id', 'day'],
+                name='unique_daily_rating',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.entity_type} #{self.entity_id} on {self.day}: {self.feedback_count} feedbacks'
+
+
+class LeaderboardEntry(models.Model):
+    SCOPE_CHOICES = (
+        ('subject', 'Lessons of subject'),
+        ('teacher', 'Lessons of teacher'),
+        ('institute', 'Teachers of institute'),
+    )
+    SIDE_CHOICES = (
+        ('top', 'Top'),
+        ('bottom', 'Bottom'),
+    )
+
+    scope_type = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    scope_id = models.BigIntegerField()
+    side = models.CharField(max_length=6, choices=SIDE_CHOICES)
+    member_id = models.BigIntegerField()
+    name = models.TextField()
+    rating = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope_type', 'scope_id', 'side', 'member_id'],
+                name='unique_leaderboard_member',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['scope_type', 'member_id'], name='leaderboard_member_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.side} of {self.scope_type} #{self.scope_id}: {self.name} ({self.rating})'
+
+
+class LeaderboardScope(models.Model):
+    # Строка-замок доски: обновления одной области идут по очереди, не блокируя предмет, преподавателя или институт
+    scope_type = models.CharField(max_length=10, choices=LeaderboardEntry.SCOPE_CHOICES)
+    scope_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope_type', 'scope_id'],
+                name='unique_leaderboard_scope',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.scope_type} #{self.scope_id}'
+
+
+class DirtyRating(models.Model):
+    ENTITY_CHOICES = (
+        ('lesson', 'Lesson'),
+        ('subject', 'Subject'),
+        ('teacher', 'Teacher'),
+        ('institute', 'Institute'),
+    )
+
+    entity_type = models.CharField(max_length=10, choices=ENTITY_CHOICES)
+    entity_id = models.BigIntegerField()
+    marked_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity_type', 'entity_id'],
+                name='unique_dirty_rating',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Dirty {self.entity_type} #{self.entity_id}'
+
+
+class TeacherPraiseCounter(models.Model):
+    teacher = models.ForeignKey(User, on_delete=models.CASCADE, related_name='praise_counters')
+    praise = models.CharField(max_length=255)
+    rating = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['teacher', 'praise', 'rating'],
+                name='unique_teacher_praise_rating',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.praise} ({self.rating}) x{self.count} for {self.teacher}'
@@ -0,0 +1,106 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+
+from .models import StudentFeedback, TeacherPraiseCounter
+
+PRAISE_MAX_LENGTH = TeacherPraiseCounter._meta.get_field('praise').max_length
+
+
+def _tally(rows):
+    counts = Counter()
+    for teacher_id, rating, praises in rows:
+        for praise in praises or []:
+            counts[teacher_id, str(praise)[:PRAISE_MAX_LENGTH], int(rating or 0)] += 1
+    return counts
+
+
+def count_praises(feedbacks, sign=1):
+    counts = _tally((fb.teacher_id, fb.rating, fb.praises) for fb in feedbacks if fb.teacher_id is not None)
+    if not counts:
+        return
+    # Строки счётчиков всегда трогаем в порядке ключа, чтобы параллельные батчи не ждали друг друга по кругу
+    counts = sorted(counts.items())
+    if sign < 0:
+        for (teacher_id, praise, rating), count in counts:
+            TeacherPraiseCounter.objects.filter(
+                teacher_id=teacher_id, praise=praise, rating=rating
+            ).update(count=Greatest(F('count') - count, 0))
+        return
+
+    table = TeacherPraiseCounter._meta.db_table
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(counts))
+    params = [value for key, count in counts for value in (*key, count)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (teacher_id, praise, rating, count) VALUES {values} '
+            f'ON CONFLICT (teacher_id, praise, rating) '
+            f'DO UPDATE SET count = {table}.count + EXCLUDED.count',
+            params,
+        )
+
+
+def praise_counts(feedbacks):
+    sql, params = feedbacks.order_by().values('rating', 'praises').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT p.praise, fb.rating, COUNT(*) FROM ({sql}) AS fb '
+            f'CROSS JOIN LATERAL jsonb_array_elements_text(CASE '
+            f"WHEN jsonb_typeof(fb.praises) = 'array' THEN fb.praises ELSE '[]'::jsonb END"
+            f') AS p(praise) '
+            f'GROUP BY p.praise, fb.rating',
+            params,
+        )
+        return cursor.fetchall()
+
+
+def top_praises(rows, good_from):
+    good, bad = Counter(), Counter()
+    for praise, rating, count in rows:
+        (good if rating >= good_from else bad)[praise] += count
+
+    def most_frequent(counts):
+        if not counts:
+            return None
+        return min(counts.items(), key=lambda item: (-item[1], item[0]))[0]
+
+    return most_frequent(good), most_frequent(bad)
+
+
+def _most_frequent(counters):
+    row = counters.values('praise').annotate(total=Sum('count')).filter(
+        total__gt=0
+    ).order_by('-total', 'praise').first()
+    return row['praise'] if row else None
+
+
+def teacher_top_praises(teacher_id, good_from):
+    counters = TeacherPraiseCounter.objects.filter(teacher_id=teacher_id)
+    return (
+        _most_frequent(counters.filter(rating__gte=good_from)),
+        _most_frequent(counters.filter(rating__lt=good_from)),
+    )
+
+
+def rebuild_praise_counters(teacher_id=None, chunk_size=2000):
+    counters = TeacherPraiseCounter.objects.all()
+    feedbacks = StudentFeedback.objects.exclude(praises=[])
+    if teacher_id is not None:
+        counters = counters.filter(teacher_id=teacher_id)
+        feedbacks = feedbacks.filter(teacher_id=teacher_id)
+
+    counts = _tally(
+        feedbacks.values_list('teacher_id', 'rating', 'praises').iterator(chunk_size=chunk_size)
+    )
+    with transaction.atomic():
+        counters.delete()
+        TeacherPraiseCounter.objects.bulk_create(
+            [
+                TeacherPraiseCounter(teacher_id=teacher, praise=praise, rating=rating, count=count)
+                for (teacher, praise, rating), count in counts.items()
+            ],
+            batch_size=chunk_size,
+        )
+    return len(counts)
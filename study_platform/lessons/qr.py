@@ -0,0 +1,118 @@
+import hashlib
+import io
+
+import qrcode
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LessonQRCode
+
+QR_BORDER = 4
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+RENDER_VERSION = 1
+
+
+def feedback_form_url(unique_code):
+    return f"{settings.FRONTEND_BASE_URL.rstrip('/')}/form/{unique_code}/"
+
+
+def _accepted(accept):
+    ranges = []
+    for item in accept.split(','):
+        media_range, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_range:
+            ranges.append((media_range.lower(), quality))
+    return ranges
+
+
+def _quality(ranges, content_type):
+    # Берём самый конкретный подходящий диапазон: image/svg+xml, затем image/*, затем */*
+    main_type = content_type.split('/')[0]
+    for candidate in (content_type, f'{main_type}/*', '*/*'):
+        qualities = [quality for media_range, quality in ranges if media_range == candidate]
+        if qualities:
+            return max(qualities)
+    return 0.0
+
+
+def negotiate_format(request):
+    requested = request.GET.get('format')
+    if requested in QR_FORMATS:
+        return requested
+    # PNG по умолчанию, SVG только если клиент явно предпочитает его остальным картинкам
+    ranges = _accepted(request.META.get('HTTP_ACCEPT', ''))
+    if _quality(ranges, QR_FORMATS['svg']) > _quality(ranges, QR_FORMATS['png']):
+        return 'svg'
+    return 'png'
+
+
+def negotiate_size(request):
+    try:
+        size = int(request.GET.get('size', settings.QR_DEFAULT_SIZE))
+    except ValueError:
+        size = settings.QR_DEFAULT_SIZE
+    return min(max(size, settings.QR_MIN_SIZE), settings.QR_MAX_SIZE)
+
+
+def qr_digest(content, fmt, size):
+    key = f'{RENDER_VERSION}|{fmt}|{size}|{content}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _svg(matrix, size):
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+    width = len(matrix)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {width} {width}" shape-rendering="crispEdges">'
+        f'<rect width="{width}" height="{width}" fill="#fff"/>'
+        f'<path d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+def render_qr(content, fmt='png', size=None):
+    qr = qrcode.QRCode(border=QR_BORDER)
+    qr.add_data(content)
+    qr.make(fit=True)
+    size = size or settings.QR_DEFAULT_SIZE
+    if fmt == 'svg':
+        return _svg(qr.get_matrix(), size)
+
+    qr.box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+    buffer = io.BytesIO()
+    qr.make_image().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def get_qr_image(content, fmt='png', size=None, lesson_id=None):
+    key = f'qr:{qr_digest(content, fmt, size)}'
+    image = cache.get(key)
+    if image is None:
+        stored = None
+        if lesson_id is not None and fmt == 'png' and size == settings.QR_DEFAULT_SIZE:
+            # PNG по умолчанию уже отрисован generate_lesson_qr при создании урока
+            stored = LessonQRCode.objects.filter(lesson_id=lesson_id).values_list('image', flat=True).first()
+        image = bytes(stored) if stored is not None else render_qr(content, fmt, size)
+        cache.set(key, image, timeout=settings.QR_CACHE_MAX_AGE)
+    return image
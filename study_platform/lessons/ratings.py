@@ -0,0 +1,484 @@
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Avg, Case, Count, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from .leaderboards import member_name, rebuild_leaderboards, update_members
+from .models import DirtyRating, Lesson, StudentFeedback
+from .praises import count_praises
+from .rollups import record_days
+from .stars import STAR_FIELDS, STARS
+from .versions import bump_versions
+from accounts.models import User
+from institute.models import Institute
+from subjects.models import Subject
+
+
+def _shift(obj, sum_field, count_field, old_rating, new_rating):
+    total = getattr(obj, sum_field) + (new_rating or 0) - (old_rating or 0)
+    count = getattr(obj, count_field) + bool(new_rating) - bool(old_rating)
+    if count <= 0:
+        total, count = 0, 0
+    setattr(obj, sum_field, total)
+    setattr(obj, count_field, count)
+    return total / count if count else 0
+
+
+def _changed(shifts):
+    return {
+        entity_id: changes
+        for entity_id, changes in shifts.items()
+        if entity_id is not None and any((old or 0) != (new or 0) for old, new in changes)
+    }
+
+
+def _update_institutes(shifts):
+    # Инкремент берёт блокировку строки до конца транзакции, поэтому институты всегда обновляются последними
+    for institute_id, changes in sorted(_changed(shifts).items()):
+        rating_delta = sum((new or 0) - (old or 0) for old, new in changes)
+        count_delta = sum(bool(new) - bool(old) for old, new in changes)
+        total = F('teacher_rating_sum') + rating_delta
+        count = F('rated_teacher_count') + count_delta
+        rated = GreaterThan(count, 0)
+        Institute.objects.filter(id=institute_id).update(
+            teacher_rating_sum=Case(When(rated, then=total), default=0.0),
+            rated_teacher_count=Case(When(rated, then=count), default=0),
+            rating=Case(When(rated, then=total / count), default=0.0),
+        )
+
+
+def _update_teachers(shifts):
+    shifts = _changed(shifts)
+    institute_shifts = defaultdict(list)
+    for teacher in User.objects.select_for_update().filter(id__in=shifts, role='teacher').order_by('id'):
+        previous = teacher.rating
+        for old, new in shifts[teacher.id]:
+            teacher.rating = _shift(teacher, 'subject_rating_sum', 'rated_subject_count', old, new)
+        teacher.save(update_fields=['rating', 'subject_rating_sum', 'rated_subject_count'])
+        institute_shifts[teacher.institute_id].append((previous, teacher.rating))
+    _update_institutes(institute_shifts)
+
+
+def _update_subjects(shifts):
+    shifts = _changed(shifts)
+    teacher_shifts = defaultdict(list)
+    for subject in Subject.objects.select_for_update().filter(id__in=shifts).order_by('id'):
+        previous = subject.rating
+        for old, new in shifts[subject.id]:
+            subject.rating = _shift(subject, 'lesson_rating_sum', 'rated_lesson_count', old, new)
+        subject.save(update_fields=['rating', 'lesson_rating_sum', 'rated_lesson_count'])
+        teacher_shifts[subject.teacher_id].append((previous, subject.rating))
+    _update_teachers(teacher_shifts)
+
+
+def _update_counters(feedbacks, sign):
+    subjects, teachers, institutes = Counter(), Counter(), Counter()
+    for fb in feedbacks:
+        rating = int(fb.rating or 0)
+        if rating in STARS:
+            field = f'stars_{rating}'
+            subjects[fb.subject_id, field] += sign
+            teachers[fb.teacher_id, field] += sign
+            institutes[fb.institute_id, field] += sign
+        teachers[fb.teacher_id, 'feedback_count'] += sign
+    # Одно обновление на сущность в порядке блокировок пересчёта
+    for model, deltas in ((Subject, subjects), (User, teachers), (Institute, institutes)):
+        updates = {}
+        for (entity_id, field), delta in deltas.items():
+            if entity_id is not None and delta:
+                updates.setdefault(entity_id, {})[field] = Greatest(F(field) + delta, 0)
+        for entity_id in sorted(updates):
+            model.objects.filter(id=entity_id).update(**updates[entity_id])
+
+
+def lock_hierarchy(lesson_ids):
+    # Все писатели блокируют строки одинаково: уроки, предметы, преподаватели, институты, внутри уровня по возрастанию id
+    lessons = Lesson.objects.select_for_update().filter(id__in=lesson_ids).order_by('id').in_bulk()
+    subject_teacher_ids = Subject.objects.select_for_update().filter(
+        id__in={lesson.subject_id for lesson in lessons.values()}
+    ).order_by('id').values_list('teacher_id', flat=True)
+    teacher_ids = {lesson.teacher_id for lesson in lessons.values()} | set(subject_teacher_ids)
+    institute_ids = User.objects.select_for_update().filter(id__in=teacher_ids - {None}).order_by('id').values_list(
+        'institute_id', flat=True
+    )
+    institute_ids = {lesson.institute_id for lesson in lessons.values()} | set(institute_ids)
+    list(Institute.objects.select_for_update().filter(id__in=institute_ids - {None}).order_by('id').values_list(
+        'id', flat=True
+    ))
+    return lessons
+
+
+def _apply_lesson(lesson, feedbacks, sign):
+    ratings = [int(fb.rating) for fb in feedbacks if fb.rating]
+    previous = lesson.average_rating
+    lesson.rating_sum = max(lesson.rating_sum + sign * sum(ratings), 0)
+    lesson.feedback_count = max(lesson.feedback_count + sign * len(ratings), 0)
+    if lesson.feedback_count:
+        lesson.average_rating = lesson.rating_sum / lesson.feedback_count
+    else:
+        lesson.rating_sum = 0
+        lesson.average_rating = None
+    for star, count in Counter(ratings).items():
+        if star in STARS:
+            field = f'stars_{star}'
+            setattr(lesson, field, max(getattr(lesson, field) + sign * count, 0))
+    return previous
+
+
+def _update_lesson_boards(lessons):
+    for scope_type in ('subject', 'teacher'):
+        members = defaultdict(list)
+        for lesson in lessons:
+            members[getattr(lesson, f'{scope_type}_id')].append(
+                (lesson.pk, member_name(scope_type, lesson), lesson.average_rating)
+            )
+        for scope_id in sorted(members.keys() - {None}):
+            update_members(scope_type, scope_id, members[scope_id])
+
+
+def _apply_batch(feedbacks_by_lesson, sign):
+    feedbacks_by_lesson = {lesson_id: feedbacks for lesson_id, feedbacks in feedbacks_by_lesson.items() if feedbacks}
+    if not feedbacks_by_lesson:
+        return
+    with transaction.atomic():
+        # Блокируем весь батч заранее, иначе два батча с общими уроками захватят строки вперемешку и встанут в deadlock
+        lessons = lock_hierarchy(list(feedbacks_by_lesson))
+        if not lessons:
+            return
+        feedbacks = [fb for lesson_id in lessons for fb in feedbacks_by_lesson[lesson_id]]
+        # Все дельты батча складываем по сущностям: одно обновление на строку, а не на отзыв
+        subject_shifts = defaultdict(list)
+        changed = []
+        for lesson_id, lesson in lessons.items():
+            stars = [getattr(lesson, field) for field in STAR_FIELDS]
+            previous = _apply_lesson(lesson, feedbacks_by_lesson[lesson_id], sign)
+            subject_shifts[lesson.subject_id].append((previous, lesson.average_rating))
+            # Отзывы без оценки не меняют ни среднего, ни распределения урока
+            if previous != lesson.average_rating or stars != [getattr(lesson, field) for field in STAR_FIELDS]:
+                changed.append(lesson)
+        Lesson.objects.bulk_update(changed, ['rating_sum', 'feedback_count', 'average_rating', *STAR_FIELDS])
+        _update_counters(feedbacks, sign)
+        _update_subjects(subject_shifts)
+        count_praises(feedbacks, sign)
+        record_days(feedbacks, sign)
+        # bulk_update обходит сигналы урока, поэтому доски и версии обновляем здесь же, по разу на область
+        _update_lesson_boards(changed)
+        bump_versions(*{
+            entity for lesson in changed
+            for entity in (('subject', lesson.subject_id), ('teacher', lesson.teacher_id))
+        })
+
+
+def record_feedbacks(feedbacks_by_lesson):
+    _apply_batch(feedbacks_by_lesson, 1)
+
+
+def retract_feedbacks(feedbacks_by_lesson):
+    _apply_batch(feedbacks_by_lesson, -1)
+
+
+def retract_lessons(lessons):
+    feedbacks = list(StudentFeedback.objects.filter(lesson__in=lessons).only(
+        'teacher_id', 'subject_id', 'institute_id', 'rating', 'praises', 'created_at'
+    ).iterator(chunk_size=2000))
+    if not feedbacks:
+        return
+    with transaction.atomic():
+        lock_hierarchy(lessons)
+        _update_counters(feedbacks, -1)
+        count_praises(feedbacks, -1)
+        # Дневные строки самих уроков удаляются вместе с уроками
+        record_days(feedbacks, -1, entity_types=('subject', 'teacher', 'institute'))
+
+
+def retract_ratings(lessons=None, subjects=None, teachers=None):
+    # Средние удаляемых строк сразу списываем с родителей, которые переживут удаление
+    with transaction.atomic():
+        if lessons is not None:
+            shifts = defaultdict(list)
+            for subject_id, rating in lessons.filter(average_rating__gt=0).values_list('subject_id', 'average_rating'):
+                shifts[subject_id].append((rating, None))
+            _update_subjects(shifts)
+        if subjects is not None:
+            shifts = defaultdict(list)
+            for teacher_id, rating in subjects.filter(rating__gt=0).values_list('teacher_id', 'rating'):
+                shifts[teacher_id].append((rating, None))
+            _update_teachers(shifts)
+        if teachers is not None:
+            shifts = defaultdict(list)
+            rated = teachers.filter(role='teacher', rating__gt=0)
+            for institute_id, rating in rated.values_list('institute_id', 'rating'):
+                shifts[institute_id].append((rating, None))
+            _update_institutes(shifts)
+
+
+def _count_updates(counter, counts):
+    for entity_type, count in counts.items():
+        if not count:
+            continue
+        key = f'rating_update:{counter}:{entity_type}'
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, count)
+
+
+def rating_update_stats():
+    counters = ('marked', 'coalesced', 'recomputed')
+    keys = {
+        (entity_type, counter): f'rating_update:{counter}:{entity_type}'
+        for entity_type, _ in DirtyRating.ENTITY_CHOICES
+        for counter in counters
+    }
+    values = cache.get_many(keys.values())
+    stats = {entity_type: {} for entity_type, _ in DirtyRating.ENTITY_CHOICES}
+    for (entity_type, counter), key in keys.items():
+        stats[entity_type][counter] = values.get(key, 0)
+    return stats
+
+
+def mark_dirty(lessons=(), subjects=(), teachers=(), institutes=()):
+    marks = [
+        (entity_type, entity_id)
+        for entity_type, ids in (
+            ('lesson', lessons),
+            ('subject', subjects),
+            ('teacher', teachers),
+            ('institute', institutes),
+        )
+        for entity_id in set(ids)
+        if entity_id is not None
+    ]
+    if not marks:
+        return
+    table = DirtyRating._meta.db_table
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (entity_type, entity_id, marked_at) VALUES {', '.join(['(%s, %s, %s)'] * len(marks))} "
+            f'ON CONFLICT (entity_type, entity_id) DO NOTHING RETURNING entity_type',
+            [value for mark in marks for value in (*mark, now)],
+        )
+        marked = Counter(row[0] for row in cursor.fetchall())
+    # Сущность, уже ждущая пересчёта, пересчитается один раз: повторная отметка в ней растворяется
+    _count_updates('marked', marked)
+    _count_updates('coalesced', Counter(entity_type for entity_type, _ in marks) - marked)
+
+
+def _average(total, count):
+    return total / count if count else 0
+
+
+def _star_counts(feedbacks):
+    return feedbacks.aggregate(**{field: Count('id', filter=Q(rating=star)) for star, field in zip(STARS, STAR_FIELDS)})
+
+
+def _set_star_counts(obj, feedbacks):
+    for field, count in _star_counts(feedbacks).items():
+        setattr(obj, field, count)
+
+
+@transaction.atomic
+def recompute_lesson(lesson_id):
+    lesson = Lesson.objects.select_for_update().filter(id=lesson_id).first()
+    if lesson is None:
+        return None
+    stats = StudentFeedback.objects.filter(lesson=lesson).exclude(
+        Q(rating__isnull=True) | Q(rating=0)
+    ).aggregate(total=Sum('rating'), count=Count('id'))
+    lesson.rating_sum = stats['total'] or 0
+    lesson.feedback_count = stats['count']
+    lesson.average_rating = _average(lesson.rating_sum, lesson.feedback_count) or None
+    _set_star_counts(lesson, StudentFeedback.objects.filter(lesson=lesson))
+    lesson.save(update_fields=['rating_sum', 'feedback_count', 'average_rating', *STAR_FIELDS])
+    return lesson
+
+
+@transaction.atomic
+def recompute_subject(subject_id):
+    subject = Subject.objects.select_for_update().filter(id=subject_id).first()
+    if subject is None:
+        return None
+    stats = Lesson.objects.filter(subject=subject, average_rating__gt=0).aggregate(total=Sum('average_rating'), count=Count('id'))
+    subject.lesson_rating_sum = stats['total'] or 0
+    subject.rated_lesson_count = stats['count']
+    subject.rating = _average(subject.lesson_rating_sum, subject.rated_lesson_count)
+    _set_star_counts(subject, StudentFeedback.objects.filter(subject=subject))
+    subject.save(update_fields=['rating', 'lesson_rating_sum', 'rated_lesson_count', *STAR_FIELDS])
+    return subject
+
+
+@transaction.atomic
+def recompute_teacher(teacher_id):
+    teacher = User.objects.select_for_update().filter(id=teacher_id, role='teacher').first()
+    if teacher is None:
+        return None
+    stats = Subject.objects.filter(teacher=teacher).exclude(
+        Q(rating__isnull=True) | Q(rating=0)
+    ).aggregate(total=Sum('rating'), count=Count('id'))
+    teacher.subject_rating_sum = stats['total'] or 0
+    teacher.rated_subject_count = stats['count']
+    teacher.rating = _average(teacher.subject_rating_sum, teacher.rated_subject_count)
+    teacher.feedback_count = StudentFeedback.objects.filter(teacher=teacher).count()
+    _set_star_counts(teacher, StudentFeedback.objects.filter(teacher=teacher))
+    teacher.save(update_fields=[
+        'rating', 'subject_rating_sum', 'rated_subject_count', 'feedback_count', *STAR_FIELDS
+    ])
+    return teacher
+
+
+@transaction.atomic
+def recompute_institute(institute_id):
+    institute = Institute.objects.select_for_update().filter(id=institute_id).first()
+    if institute is None:
+        return None
+    stats = User.objects.filter(institute=institute, role='teacher', rating__gt=0).aggregate(total=Sum('rating'), count=Count('id'))
+    institute.teacher_rating_sum = stats['total'] or 0
+    institute.rated_teacher_count = stats['count']
+    institute.rating = _average(institute.teacher_rating_sum, institute.rated_teacher_count)
+    _set_star_counts(institute, StudentFeedback.objects.filter(institute=institute))
+    institute.save(update_fields=['rating', 'teacher_rating_sum', 'rated_teacher_count', *STAR_FIELDS])
+    return institute
+
+
+@transaction.atomic
+def _claim_dirty(limit, window):
+    marks = list(
+        DirtyRating.objects.select_for_update(skip_locked=True)
+        .filter(marked_at__lte=timezone.now() - timedelta(seconds=window))
+        .order_by('id')
+        .values_list('id', 'entity_type', 'entity_id')[:limit]
+    )
+    DirtyRating.objects.filter(id__in=[mark_id for mark_id, _, _ in marks]).delete()
+    return marks
+
+
+def sweep_dirty_ratings(limit, window=0):
+    # Отметки моложе window секунд ждут следующего прохода, собирая изменения той же сущности
+    marks = _claim_dirty(limit, window)
+    dirty = {entity_type: set() for entity_type, _ in DirtyRating.ENTITY_CHOICES}
+    for _, entity_type, entity_id in marks:
+        dirty[entity_type].add(entity_id)
+
+    for lesson_id in dirty['lesson']:
+        lesson = recompute_lesson(lesson_id)
+        if lesson:
+            dirty['subject'].add(lesson.subject_id)
+            dirty['teacher'].add(lesson.teacher_id)
+            dirty['institute'].add(lesson.institute_id)
+    for subject_id in dirty['subject']:
+        subject = recompute_subject(subject_id)
+        if subject and subject.teacher_id:
+            dirty['teacher'].add(subject.teacher_id)
+    for teacher_id in dirty['teacher']:
+        teacher = recompute_teacher(teacher_id)
+        if teacher:
+            dirty['institute'].add(teacher.institute_id)
+    for institute_id in dirty['institute']:
+        recompute_institute(institute_id)
+
+    recomputed = {entity_type: len(ids) for entity_type, ids in dirty.items()}
+    _count_updates('recomputed', Counter(recomputed))
+    return len(marks), recomputed
+
+
+def _group_stats(queryset, group_field, value_field):
+    return queryset.filter(**{group_field: OuterRef('pk')}).order_by().values(group_field).annotate(
+        total=Sum(value_field),
+        count=Count('id'),
+        average=Avg(value_field),
+    )
+
+
+def _star_stats(group_field):
+    stats = StudentFeedback.objects.filter(**{group_field: OuterRef('pk')}).order_by().values(group_field).annotate(
+        **{f'total_{field}': Count('id', filter=Q(rating=star)) for star, field in zip(STARS, STAR_FIELDS)}
+    )
+    return {field: Coalesce(Subquery(stats.values(f'total_{field}')), 0) for field in STAR_FIELDS}
+
+
+def _bulk_update(queryset, stats, sum_field, count_field, rating_field, empty_rating, **extra):
+    sum_output = queryset.model._meta.get_field(sum_field)
+    rating = Subquery(stats.values('average'))
+    if empty_rating is not None:
+        rating = Coalesce(rating, empty_rating)
+    return queryset.update(
+        **{
+            sum_field: Coalesce(Subquery(stats.values('total')), 0, output_field=sum_output),
+            count_field: Coalesce(Subquery(stats.values('count')), 0),
+            rating_field: rating,
+        },
+        **extra,
+    )
+
+
+def bulk_recompute(institute_id=None):
+    lessons = Lesson.objects.all()
+    subjects = Subject.objects.all()
+    teachers = User.objects.filter(role='teacher')
+    institutes = Institute.objects.all()
+    if institute_id is not None:
+        lessons = lessons.filter(institute_id=institute_id)
+        subjects = subjects.filter(id__in=lessons.values('subject_id'))
+        teachers = teachers.filter(
+            Q(institute_id=institute_id)
+            | Q(id__in=lessons.values('teacher_id'))
+            | Q(id__in=subjects.values('teacher_id'))
+        )
+        institutes = institutes.filter(
+            Q(id=institute_id) | Q(id__in=teachers.values('institute_id'))
+        )
+
+    all_feedback = StudentFeedback.objects.filter(teacher=OuterRef('pk')).order_by().values(
+        'teacher'
+    ).annotate(count=Count('id'))
+
+    levels = (
+        ('lessons', lambda: _bulk_update(
+            lessons,
+            _group_stats(StudentFeedback.objects.filter(rating__gt=0), 'lesson', 'rating'),
+            'rating_sum', 'feedback_count', 'average_rating', None,
+            **_star_stats('lesson'),
+        )),
+        ('subjects', lambda: _bulk_update(
+            subjects,
+            _group_stats(Lesson.objects.filter(average_rating__gt=0), 'subject', 'average_rating'),
+            'lesson_rating_sum', 'rated_lesson_count', 'rating', 0.0,
+            **_star_stats('subject'),
+        )),
+        ('teachers', lambda: _bulk_update(
+            teachers,
+            _group_stats(Subject.objects.filter(rating__gt=0), 'teacher', 'rating'),
+            'subject_rating_sum', 'rated_subject_count', 'rating', 0.0,
+            feedback_count=Coalesce(Subquery(all_feedback.values('count')), 0),
+            **_star_stats('teacher'),
+        )),
+        ('institutes', lambda: _bulk_update(
+            institutes,
+            _group_stats(User.objects.filter(role='teacher', rating__gt=0), 'institute', 'rating'),
+            'teacher_rating_sum', 'rated_teacher_count', 'rating', 0.0,
+            **_star_stats('institute'),
+        )),
+    )
+
+    timings = []
+    for level, update in levels:
+        started = time.monotonic()
+        with transaction.atomic():
+            rows = update()
+        timings.append((level, rows, time.monotonic() - started))
+
+    # Массовый update обходит сигналы, поэтому доски затронутых областей строим заново
+    started = time.monotonic()
+    rows = rebuild_leaderboards(None if institute_id is None else {
+        'subject': subjects.values('id'),
+        'teacher': teachers.values('id'),
+        'institute': institutes.values('id'),
+    })
+    timings.append(('leaderboards', rows, time.monotonic() - started))
+    bump_versions(everything=True)
+    return timings
@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailyRating, StudentFeedback
+from .stars import STAR_FIELDS, STARS
+
+COUNTER_FIELDS = ('feedback_count', 'rating_sum', *STAR_FIELDS)
+ENTITY_KEYS = {
+    'lesson': 'lesson_id',
+    'subject': 'subject_id',
+    'teacher': 'teacher_id',
+    'institute': 'institute_id',
+}
+TREND_PERIODS = {
+    'day': lambda field: F(field),
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def daily_entities(obj, lesson_id):
+    return [
+        ('lesson', lesson_id),
+        ('subject', obj.subject_id),
+        ('teacher', obj.teacher_id),
+        ('institute', obj.institute_id),
+    ]
+
+
+def _counters():
+    return dict.fromkeys(COUNTER_FIELDS, 0)
+
+
+def _count(counters, rating):
+    counters['feedback_count'] += 1
+    counters['rating_sum'] += rating
+    if rating in STARS:
+        counters[f'stars_{rating}'] += 1
+
+
+def tally_days(rows):
+    days = defaultdict(_counters)
+    for created_at, rating in rows:
+        rating = int(rating or 0)
+        if rating:
+            _count(days[timezone.localdate(created_at)], rating)
+    return days
+
+
+def _apply_rows(rows, sign):
+    if not rows:
+        return
+    # Строки берём в порядке ключа, чтобы параллельные батчи блокировали их одинаково
+    rows = sorted(rows.items())
+    if sign < 0:
+        for (entity_type, entity_id, day), counters in rows:
+            DailyRating.objects.filter(entity_type=entity_type, entity_id=entity_id, day=day).update(**{
+                field: Greatest(F(field) - count, 0) for field, count in counters.items() if count
+            })
+        return
+
+    table = DailyRating._meta.db_table
+    columns = ('entity_type', 'entity_id', 'day', *COUNTER_FIELDS)
+    row = f"({', '.join(['%s'] * len(columns))})"
+    params = [
+        value
+        for key, counters in rows
+        for value in (*key, *(counters[field] for field in COUNTER_FIELDS))
+    ]
+    updates = ', '.join(f'{field} = {table}.{field} + EXCLUDED.{field}' for field in COUNTER_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES {', '.join([row] * len(rows))} "
+            f'ON CONFLICT (entity_type, entity_id, day) DO UPDATE SET {updates}',
+            params,
+        )
+
+
+def apply_days(entities, days, sign=1):
+    _apply_rows({
+        (entity_type, entity_id, day): counters
+        for entity_type, entity_id in entities
+        if entity_id is not None
+        for day, counters in days.items()
+    }, sign)
+
+
+def record_days(feedbacks, sign=1, entity_types=tuple(ENTITY_KEYS)):
+    # Отзывы батча сразу раскладываем по сущностям и дням: одна вставка на весь батч
+    rows = defaultdict(_counters)
+    for fb in feedbacks:
+        rating = int(fb.rating or 0)
+        if not rating:
+            continue
+        day = timezone.localdate(fb.created_at)
+        for entity_type in entity_types:
+            entity_id = getattr(fb, ENTITY_KEYS[entity_type])
+            if entity_id is not None:
+                _count(rows[entity_type, entity_id, day], rating)
+    _apply_rows(rows, sign)
+
+
+def move_days(lesson_id, previous, current):
+    days = {
+        row.pop('day'): row
+        for row in DailyRating.objects.filter(entity_type='lesson', entity_id=lesson_id).values('day', *COUNTER_FIELDS)
+    }
+    moved = [
+        entity_type for entity_type in ('subject', 'teacher', 'institute')
+        if previous[f'{entity_type}_id'] != getattr(current, f'{entity_type}_id')
+    ]
+    apply_days([(entity_type, previous[f'{entity_type}_id']) for entity_type in moved], days, -1)
+    apply_days([(entity_type, getattr(current, f'{entity_type}_id')) for entity_type in moved], days, 1)
+
+
+def rebuild_daily_ratings(entity_type=None, chunk_size=2000):
+    entity_types = [entity_type] if entity_type else list(ENTITY_KEYS)
+    created = 0
+    with transaction.atomic():
+        DailyRating.objects.filter(entity_type__in=entity_types).delete()
+        for entity_type in entity_types:
+            key = ENTITY_KEYS[entity_type]
+            rows = StudentFeedback.objects.filter(rating__gt=0, **{f'{key}__isnull': False}).annotate(
+                day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()),
+            ).order_by().values(key, 'day').annotate(
+                total=Count('id'),
+                total_rating=Sum('rating'),
+                **{f'total_stars_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+            ).iterator(chunk_size=chunk_size)
+
+            batch = []
+            for row in rows:
+                batch.append(DailyRating(
+                    entity_type=entity_type,
+                    entity_id=row[key],
+                    day=row['day'],
+                    feedback_count=row['total'],
+                    rating_sum=row['total_rating'],
+                    **{f'stars_{star}': row[f'total_stars_{star}'] for star in STARS},
+                ))
+                if len(batch) >= chunk_size:
+                    DailyRating.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            DailyRating.objects.bulk_create(batch)
+            created += len(batch)
+    return created
+
+
+def rating_trend(entity_type, entity_id, period, start_date=None, end_date=None):
+    rows = DailyRating.objects.filter(entity_type=entity_type, entity_id=entity_id)
+    if start_date:
+        rows = rows.filter(day__gte=start_date)
+    if end_date:
+        rows = rows.filter(day__lte=end_date)
+    rows = rows.annotate(period_start=TREND_PERIODS[period]('day')).order_by('period_start').values(
+        'period_start'
+    ).annotate(**{f'total_{field}': Sum(field) for field in COUNTER_FIELDS})
+
+    return [
+        {
+            'period_start': row['period_start'],
+            'feedback_count': row['total_feedback_count'],
+            'average_rating': (
+                row['total_rating_sum'] / row['total_feedback_count'] if row['total_feedback_count'] else None
+            ),
+            'stars': {str(star): row[f'total_stars_{star}'] for star in STARS},
+        }
+        for row in rows
+    ]
@@ -1,4 +1,7 @@
+import base64
+
 from rest_framework import serializers
+from django.db.models import Count, Prefetch
 from django.utils import timezone
 
 from .models import (
@@ -6,15 +9,57 @@ from .models import (
     FormLink,
     StudentFeedback,
 )
+from .stars import STAR_FIELDS, RatingDistributionField
 from institute.models import Institute
 from accounts.models import User
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    heavy_fields = ()
+
+    @classmethod
+    def requested_fields(cls, request, compact=False):
+        names = list(cls.Meta.fields)
+        if request is None or request.method != 'GET':
+            return names
+
+        only = request.query_params.get('fields')
+        exclude = request.query_params.get('exclude')
+        if only:
+            wanted = {name.strip() for name in only.split(',')}
+            names = [name for name in names if name in wanted]
+        elif compact:
+            names = [name for name in names if name not in cls.heavy_fields]
+        if exclude:
+            unwanted = {name.strip() for name in exclude.split(',')}
+            names = [name for name in names if name not in unwanted]
+        return names
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        context = self.context
+        selected = self.requested_fields(context.get('request'), context.get('compact', False))
+        for name in set(self.fields) - set(selected):
+            self.fields.pop(name)
+
+
+class LessonSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     unique_link = serializers.SerializerMethodField()
     is_link_active = serializers.SerializerMethodField()
     student_feedback_count = serializers.SerializerMethodField()
     student_feedback = serializers.SerializerMethodField()
+    qr_code_base64 = serializers.SerializerMethodField()
+    rating_distribution = RatingDistributionField()
+
+    heavy_fields = ('qr_code_base64', 'student_feedback')
+    model_fields = {
+        'unique_link': ('unique_code',),
+        'is_link_active': ('is_active', 'start_time', 'end_time'),
+        'student_feedback_count': (),
+        'student_feedback': (),
+        'qr_code_base64': ('qr_code__image',),
+        'rating_distribution': STAR_FIELDS,
+    }
 
     class Meta:
         model = Lesson
@@ -22,10 +67,38 @@ class LessonSerializer(serializers.ModelSerializer):
             'id', 'teacher', 'institute', 'subject', 'topic', 'location',
             'start_time', 'end_time', 'unique_code', 'unique_link',
             'is_active', 'is_link_active', 'qr_code_base64', 'average_rating',
-            'student_feedback_count', 'student_feedback'
+            'rating_distribution', 'student_feedback_count', 'student_feedback'
         ]
         read_only_fields = ['unique_code', 'unique_link', 'is_link_active']
 
+    @staticmethod
+    def can_see_feedback(request):
+        if not request:
+            return False
+        user = request.user
+        return isinstance(user, User) and user.visible_reviews
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request, compact=False):
+        names = cls.requested_fields(request, compact)
+        columns = {'id'}
+        for name in names:
+            columns.update(cls.model_fields.get(name, (name,)))
+        queryset = queryset.only(*columns)
+
+        if 'qr_code_base64' in names:
+            queryset = queryset.select_related('qr_code')
+        if 'student_feedback_count' in names:
+            queryset = queryset.annotate(student_feedback_total=Count('studentfeedback'))
+        if 'student_feedback' in names and cls.can_see_feedback(request):
+            queryset = queryset.prefetch_related(Prefetch(
+                'studentfeedback_set',
+                queryset=StudentFeedback.objects.only(
+                    'lesson_id', 'rating', 'comment', 'praises', 'created_at'
+                ),
+            ))
+        return queryset
+
     def get_unique_link(self, obj):
         frontend_base_url = 'http://localhost:5173'
         return f'{frontend_base_url}/form/{obj.unique_code}/'
@@ -33,19 +106,23 @@ class LessonSerializer(serializers.ModelSerializer):
     def get_is_link_active(self, obj):
         return obj.is_link_active()
 
+    def get_qr_code_base64(self, obj):
+        qr_code = getattr(obj, 'qr_code', None)
+        if qr_code is None:
+            return None
+        return base64.b64encode(bytes(qr_code.image)).decode('utf-8')
+
     def get_student_feedback_count(self, obj):
+        count = getattr(obj, 'student_feedback_total', None)
+        if count is not None:
+            return count
         return StudentFeedback.objects.filter(lesson=obj).count()
 
     def get_student_feedback(self, obj):
-        request = self.context.get('request')
-        if not request:
-            return []
-
-        user = request.user
-        if not isinstance(user, User) or not user.visible_reviews:
+        if not self.can_see_feedback(self.context.get('request')):
             return []
 
-        feedbacks = StudentFeedback.objects.filter(lesson=obj)
+        feedbacks = obj.studentfeedback_set.all()
         return [
             {
                 'rating': feedback.rating,
@@ -115,3 +192,19 @@ class StudentFeedbackSerializer(serializers.ModelSerializer):
             'rating', 'comment', 'praises', 'created_at'
         ]
         read_only_fields = ['created_at']
+
+
+class StudentFeedbackInputSerializer(serializers.ModelSerializer):
+    praises = serializers.ListField(child=serializers.CharField(), required=False)
+
+    class Meta:
+        model = StudentFeedback
+        fields = ['student_name', 'rating', 'comment', 'praises']
+        extra_kwargs = {
+            'rating': {'max_value': 5},
+        }
+
+
+class DateRangeSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
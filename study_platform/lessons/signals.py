@@ -0,0 +1,276 @@
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from institute.models import Institute
+from subjects.models import Subject
+from .cache import lesson_code_cache
+from .leaderboards import drop_scope, drop_stale_scopes, member_name, remove_member, update_member
+from .models import DailyRating, Lesson, StudentFeedback
+from .praises import count_praises
+from .ratings import mark_dirty, retract_feedbacks, retract_lessons, retract_ratings
+from .rollups import apply_days, daily_entities, move_days, tally_days
+from .versions import bump_versions
+
+HIERARCHY_FIELDS = ('subject_id', 'teacher_id', 'institute_id')
+WINDOW_FIELDS = {'unique_code', 'is_active', 'start_time', 'end_time'}
+LESSON_BOARD_FIELDS = {'average_rating', 'topic', 'subject', 'teacher'}
+LESSON_BOARD_VALUES = ('average_rating', 'topic', 'subject_id', 'teacher_id')
+TEACHER_BOARD_FIELDS = {'rating', 'first_name', 'surname', 'last_name', 'role', 'institute'}
+DELETED_LESSONS = {
+    Lesson: lambda ids: Q(pk__in=ids),
+    Subject: lambda ids: Q(subject__in=ids),
+    User: lambda ids: Q(teacher__in=ids) | Q(subject__teacher__in=ids),
+    Institute: lambda ids: (
+        Q(institute__in=ids) | Q(teacher__institute__in=ids) | Q(subject__teacher__institute__in=ids)
+    ),
+}
+# Удаляемые уроки, предметы и преподаватели, чьи родители остаются и должны сразу потерять их средние
+RETRACTED_RATINGS = {
+    Lesson: lambda ids: {'lessons': Lesson.objects.filter(pk__in=ids)},
+    Subject: lambda ids: {'subjects': Subject.objects.filter(pk__in=ids)},
+    User: lambda ids: {
+        'lessons': Lesson.objects.filter(teacher__in=ids).exclude(subject__teacher__in=ids),
+        'teachers': User.objects.filter(pk__in=ids),
+    },
+    Institute: lambda ids: {
+        'lessons': Lesson.objects.filter(DELETED_LESSONS[Institute](ids)).exclude(
+            subject__teacher__institute__in=ids
+        ),
+    },
+}
+
+
+def _deleting_parent(origin):
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in DELETED_LESSONS
+
+
+@receiver(post_delete, sender=StudentFeedback)
+def retract_deleted_feedback(sender, instance, origin=None, **kwargs):
+    # При удалении урока, предмета, преподавателя или института отзывы уже списаны одним пакетом
+    if _deleting_parent(origin):
+        return
+    retract_feedbacks({instance.lesson_id: [instance]})
+    mark_dirty(lessons=[instance.lesson_id])
+
+
+@receiver(pre_delete, sender=Lesson)
+@receiver(pre_delete, sender=Subject)
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Institute)
+def retract_deleted_lessons(sender, instance, origin=None, **kwargs):
+    if origin is instance:
+        ids = [instance.pk]
+    elif isinstance(origin, QuerySet) and origin.model is sender:
+        if getattr(origin, '_lessons_retracted', False):
+            return
+        origin._lessons_retracted = True
+        ids = origin.values('pk')
+    else:
+        return
+    retract_lessons(Lesson.objects.filter(DELETED_LESSONS[sender](ids)).values('pk'))
+    retract_ratings(**RETRACTED_RATINGS[sender](ids))
+
+
+@receiver(pre_save, sender=StudentFeedback)
+def copy_lesson_hierarchy(sender, instance, **kwargs):
+    if instance.teacher_id is None:
+        lesson = instance.lesson
+        instance.teacher_id = lesson.teacher_id
+        instance.subject_id = lesson.subject_id
+        instance.institute_id = lesson.institute_id
+
+
+@receiver(pre_save, sender=StudentFeedback)
+def remember_feedback_rating(sender, instance, **kwargs):
+    if instance._state.adding:
+        return
+    instance._previous_feedback = StudentFeedback.objects.filter(pk=instance.pk).only(
+        'teacher_id', 'created_at', 'rating', 'praises'
+    ).first()
+
+
+@receiver(post_save, sender=StudentFeedback)
+def mark_edited_feedback(sender, instance, created, **kwargs):
+    if created:
+        return
+    mark_dirty(lessons=[instance.lesson_id])
+    previous = getattr(instance, '_previous_feedback', None)
+    instance._previous_feedback = None
+    if previous is None:
+        return
+    with transaction.atomic():
+        if (previous.created_at, previous.rating) != (instance.created_at, instance.rating):
+            entities = daily_entities(instance, instance.lesson_id)
+            apply_days(entities, tally_days([(previous.created_at, previous.rating)]), -1)
+            apply_days(entities, tally_days([(instance.created_at, instance.rating)]), 1)
+        if (previous.teacher_id, previous.rating, previous.praises) != (
+            instance.teacher_id, instance.rating, instance.praises
+        ):
+            count_praises([previous], -1)
+            count_praises([instance], 1)
+
+
+@receiver(pre_save, sender=Lesson)
+def mark_moved_lesson(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None:
+        return
+    if update_fields is not None and not (LESSON_BOARD_FIELDS | {'institute'}) & set(update_fields):
+        return
+    previous = Lesson.objects.filter(pk=instance.pk).values(*HIERARCHY_FIELDS, *LESSON_BOARD_VALUES).first()
+    if previous is None:
+        return
+    instance._previous_board = tuple(previous[field] for field in LESSON_BOARD_VALUES)
+    if all(previous[field] == getattr(instance, field) for field in HIERARCHY_FIELDS):
+        return
+    mark_dirty(
+        lessons=[instance.pk],
+        subjects=[previous['subject_id']],
+        teachers=[previous['teacher_id']],
+        institutes=[previous['institute_id']],
+    )
+    bump_versions(('subject', previous['subject_id']), ('teacher', previous['teacher_id']))
+    instance._previous_hierarchy = previous
+
+
+@receiver(post_save, sender=Lesson)
+def move_lesson_feedback(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_hierarchy', None)
+    if created or not previous:
+        return
+    instance._previous_hierarchy = None
+    StudentFeedback.objects.filter(lesson=instance).update(
+        teacher_id=instance.teacher_id,
+        subject_id=instance.subject_id,
+        institute_id=instance.institute_id,
+        updated_at=Now(),
+    )
+    move_days(instance.pk, previous, instance)
+    if previous['teacher_id'] != instance.teacher_id:
+        feedbacks = list(StudentFeedback.objects.filter(lesson=instance).only('teacher_id', 'rating', 'praises'))
+        count_praises(feedbacks, 1)
+        for feedback in feedbacks:
+            feedback.teacher_id = previous['teacher_id']
+        count_praises(feedbacks, -1)
+
+
+@receiver(post_delete, sender=Lesson)
+def mark_deleted_lesson(sender, instance, **kwargs):
+    mark_dirty(subjects=[instance.subject_id], teachers=[instance.teacher_id])
+
+
+@receiver(post_delete, sender=User)
+def mark_deleted_teacher(sender, instance, **kwargs):
+    if instance.role == 'teacher':
+        mark_dirty(institutes=[instance.institute_id])
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def invalidate_lesson_code(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not WINDOW_FIELDS & set(update_fields):
+        return
+    lesson_code_cache.invalidate(instance.unique_code)
+
+
+@receiver(post_save, sender=Lesson)
+def bump_saved_lesson_versions(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_board', None)
+    instance._previous_board = None
+    # Кеш поиска показывает только доски уроков, поэтому версию поднимаем лишь при изменении их полей
+    if created and not instance.average_rating:
+        return
+    if not created and previous in (None, tuple(getattr(instance, field) for field in LESSON_BOARD_VALUES)):
+        return
+    bump_versions(('subject', instance.subject_id), ('teacher', instance.teacher_id))
+
+
+@receiver(post_delete, sender=Lesson)
+def bump_deleted_lesson_versions(sender, instance, **kwargs):
+    bump_versions(('subject', instance.subject_id), ('teacher', instance.teacher_id))
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def bump_subject_version(sender, instance, **kwargs):
+    bump_versions(('subject', instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_teacher_versions(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_versions(('teacher', instance.pk), ('institute', instance.institute_id))
+
+
+@receiver(post_save, sender=Institute)
+@receiver(post_delete, sender=Institute)
+def bump_institute_version(sender, instance, **kwargs):
+    bump_versions(('institute', instance.pk))
+
+
+@receiver(post_save, sender=Lesson)
+def update_lesson_leaderboards(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not LESSON_BOARD_FIELDS & set(update_fields):
+        return
+    if created and not instance.average_rating:
+        return
+    if update_fields is None or {'subject', 'teacher'} & set(update_fields):
+        drop_stale_scopes('subject', instance.pk, instance.subject_id)
+        drop_stale_scopes('teacher', instance.pk, instance.teacher_id)
+    name = member_name('subject', instance)
+    update_member('subject', instance.subject_id, instance.pk, name, instance.average_rating)
+    update_member('teacher', instance.teacher_id, instance.pk, name, instance.average_rating)
+
+
+@receiver(post_delete, sender=Lesson)
+def remove_lesson_from_leaderboards(sender, instance, **kwargs):
+    remove_member('subject', instance.subject_id, instance.pk)
+    remove_member('teacher', instance.teacher_id, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def update_teacher_leaderboard(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not TEACHER_BOARD_FIELDS & set(update_fields):
+        return
+    if created and not instance.rating:
+        return
+    if update_fields is None or 'institute' in update_fields:
+        drop_stale_scopes('institute', instance.pk, instance.institute_id)
+    if instance.role != 'teacher':
+        remove_member('institute', instance.institute_id, instance.pk)
+        return
+    update_member(
+        'institute', instance.institute_id, instance.pk,
+        member_name('institute', instance), instance.rating,
+    )
+
+
+@receiver(post_delete, sender=User)
+def remove_teacher_from_leaderboards(sender, instance, **kwargs):
+    remove_member('institute', instance.institute_id, instance.pk)
+    drop_scope('teacher', instance.pk)
+
+
+@receiver(post_delete, sender=Subject)
+def drop_subject_leaderboard(sender, instance, **kwargs):
+    drop_scope('subject', instance.pk)
+
+
+@receiver(post_delete, sender=Institute)
+def drop_institute_leaderboard(sender, instance, **kwargs):
+    drop_scope('institute', instance.pk)
+
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Institute)
+def drop_daily_ratings(sender, instance, **kwargs):
+    entity_type = {Lesson: 'lesson', Subject: 'subject', User: 'teacher', Institute: 'institute'}[sender]
+    DailyRating.objects.filter(entity_type=entity_type, entity_id=instance.pk).delete()
@@ -0,0 +1,121 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .ingest import ingest_feedbacks, publish_feedback
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_MODES = {
+    'always': 'FULL',
+    'batch': 'NORMAL',
+    'off': 'OFF',
+}
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class FeedbackSpool:
+    def __init__(self, path, fsync='batch', max_entries=None):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={SYNCHRONOUS_MODES[self.fsync]}')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS dead_entries ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, error TEXT NOT NULL, '
+                'created_at REAL NOT NULL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def size(self):
+        row = self.connection.execute('SELECT MIN(id), MAX(id) FROM entries').fetchone()
+        return row[1] - row[0] + 1 if row[0] is not None else 0
+
+    def append(self, payload):
+        if self.max_entries and self.size() >= self.max_entries:
+            raise SpoolFull()
+        self.connection.execute(
+            'INSERT INTO entries (payload, created_at) VALUES (?, ?)',
+            (json.dumps(payload), time.time()),
+        )
+
+    def read(self, limit):
+        rows = self.connection.execute(
+            'SELECT id, payload FROM entries ORDER BY id LIMIT ?', (limit,)
+        ).fetchall()
+        return [(entry_id, json.loads(payload)) for entry_id, payload in rows]
+
+    def bury(self, rejected):
+        now = time.time()
+        self.connection.executemany(
+            'INSERT INTO dead_entries (payload, error, created_at) VALUES (?, ?, ?)',
+            [(json.dumps(payload), error, now) for payload, error in rejected],
+        )
+
+    def remove_through(self, entry_id):
+        self.connection.execute('DELETE FROM entries WHERE id <= ?', (entry_id,))
+
+    def checkpoint(self):
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+feedback_spool = FeedbackSpool(
+    settings.FEEDBACK_SPOOL_PATH,
+    fsync=settings.FEEDBACK_SPOOL_FSYNC,
+    max_entries=settings.FEEDBACK_SPOOL_MAX_ENTRIES,
+)
+
+
+def forward_entries(entries, target):
+    payloads = [payload for _, payload in entries]
+    if target == 'broker':
+        # Окно урока проверено при приёме отзыва, после сбоя оно могло уже закрыться
+        for payload in payloads:
+            publish_feedback({**payload, 'window_checked': True})
+        return []
+    _, rejected = ingest_feedbacks(payloads, check_window=False)
+    return rejected
+
+
+def drain_spool(spool, batch_size, target, idle_sleep=1.0):
+    backlog = spool.size()
+    if backlog:
+        logger.info('Replaying %s spooled feedbacks', backlog)
+    while True:
+        entries = spool.read(batch_size)
+        if not entries:
+            spool.checkpoint()
+            time.sleep(idle_sleep)
+            continue
+        try:
+            rejected = forward_entries(entries, target)
+        except Exception:
+            logger.exception('Failed to forward %s spooled feedbacks', len(entries))
+            time.sleep(idle_sleep)
+            continue
+        if rejected:
+            logger.warning('Moving %s rejected spooled feedbacks to dead entries', len(rejected))
+            spool.bury(rejected)
+        spool.remove_through(entries[-1][0])
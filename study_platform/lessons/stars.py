@@ -0,0 +1,38 @@
+from rest_framework import serializers
+
+STARS = range(1, 6)
+STAR_FIELDS = tuple(f'stars_{star}' for star in STARS)
+
+
+def star_histogram(obj):
+    return {str(star): getattr(obj, f'stars_{star}') for star in STARS}
+
+
+def histogram_median(histogram):
+    total = sum(histogram.values())
+    if not total:
+        return None
+    # Медиана — среднее двух центральных оценок, при нечётном числе они совпадают
+    middle = ((total - 1) // 2, total // 2)
+    values = []
+    seen = 0
+    for star in STARS:
+        count = histogram[str(star)]
+        values.extend(star for position in middle if seen <= position < seen + count)
+        seen += count
+    return sum(values) / len(values)
+
+
+def rating_distribution(obj):
+    histogram = star_histogram(obj)
+    return {'stars': histogram, 'median': histogram_median(histogram)}
+
+
+class RatingDistributionField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return rating_distribution(value)
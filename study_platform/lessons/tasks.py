@@ -1,72 +1,41 @@
 from celery import shared_task
-from django.db.models import Avg, Q
+from django.conf import settings
 
-from .models import StudentFeedback, Lesson
-from accounts.models import User
-from institute.models import Institute
-from subjects.models import Subject
+from .ingest import ingest_feedbacks, publish_dead_letters
+from .models import Lesson, LessonQRCode
+from .qr import feedback_form_url, get_qr_image
+from .ratings import bulk_recompute, sweep_dirty_ratings
 
 
 @shared_task
 def process_feedback(feedback_data):
-    lesson_id = feedback_data.pop('lesson')
-    lesson = Lesson.objects.get(id=lesson_id)
-    if not lesson.is_link_active():
-        return
-    StudentFeedback.objects.create(lesson=lesson, **feedback_data)
-
-
-@shared_task
-def update_lesson_rating(lesson_id):
-    lesson = Lesson.objects.get(id=lesson_id)
-    feedbacks = StudentFeedback.objects.filter(lesson=lesson).exclude(
-        Q(rating__isnull=True) | Q(rating=0)
-    )
-    if feedbacks.exists():
-        lesson.average_rating = feedbacks.aggregate(Avg('rating'))['rating__avg'] or 0
-        lesson.feedback_count = feedbacks.count()
-    else:
-        lesson.average_rating = None
-        lesson.feedback_count = 0
-    lesson.save()
-    update_subject_rating.delay(lesson.subject_id)
-    update_teacher_rating.delay(lesson.teacher_id)
-    update_institute_rating.delay(lesson.institute_id)
+    _, rejected = ingest_feedbacks([feedback_data])
+    publish_dead_letters(rejected)
 
 
 @shared_task
-def update_subject_rating(subject_id):
-    subject = Subject.objects.get(id=subject_id)
-    lessons = Lesson.objects.filter(subject=subject).exclude(
-        Q(average_rating__isnull=True) | Q(average_rating=0)
-    )
-    subject.rating = lessons.aggregate(Avg('average_rating'))['average_rating__avg'] or 0
-    subject.save()
-
-
-@shared_task
-def update_teacher_rating(teacher_id):
-    teacher = User.objects.get(id=teacher_id, role='teacher')
-    subjects = Subject.objects.filter(teacher=teacher).exclude(Q(rating__isnull=True) | Q(rating=0))
-    teacher.rating = subjects.aggregate(Avg('rating'))['rating__avg'] or 0
-    teacher.feedback_count = StudentFeedback.objects.filter(lesson__teacher=teacher).count()
-    teacher.save()
+def generate_lesson_qr(lesson_id):
+    unique_code = Lesson.objects.filter(pk=lesson_id).values_list('unique_code', flat=True).first()
+    if unique_code is None:
+        return
+    image = get_qr_image(feedback_form_url(unique_code), 'png', settings.QR_DEFAULT_SIZE)
+    LessonQRCode.objects.update_or_create(lesson_id=lesson_id, defaults={'image': image})
 
 
 @shared_task
-def update_institute_rating(institute_id):
-    institute = Institute.objects.get(id=institute_id)
-    teachers = User.objects.filter(institute=institute, role='teacher')
-    teachers_with_valid_ratings = teachers.exclude(
-        Q(rating__isnull=True) | Q(rating=0)
-    )
-    institute.rating = teachers_with_valid_ratings.aggregate(
-        Avg('rating'))['rating__avg'] or 0
-    institute.save()
+def recalculate_all_ratings(institute_id=None):
+    return [
+        {'level': level, 'rows': rows, 'seconds': round(seconds, 3)}
+        for level, rows, seconds in bulk_recompute(institute_id)
+    ]
 
 
 @shared_task
-def recalculate_all_ratings():
-    lessons = Lesson.objects.all()
-    for lesson in lessons:
-        update_lesson_rating.delay(lesson.id)
+def recalculate_dirty_ratings():
+    limit, window = settings.RATING_SWEEP_BATCH_SIZE, settings.RATING_COALESCE_WINDOW
+    claimed, recomputed = sweep_dirty_ratings(limit, window)
+    while claimed == limit:
+        claimed, batch = sweep_dirty_ratings(limit, window)
+        for entity_type, count in batch.items():
+            recomputed[entity_type] += count
+    return recomputed
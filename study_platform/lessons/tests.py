@@ -0,0 +1,586 @@
+import base64
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from institute.models import Institute
+from subjects.models import Subject
+from .admission import ADMITTED, DUPLICATE, FLOOD, FeedbackAdmission
+from .cache import lesson_code_cache
+from .ingest import ingest_feedbacks
+from .management.commands.check_query_plans import hot_queries
+from .models import DailyRating, LeaderboardEntry, LeaderboardScope, Lesson, LessonQRCode, StudentFeedback, TeacherPraiseCounter
+from .praises import praise_counts, rebuild_praise_counters, teacher_top_praises, top_praises
+from .ratings import bulk_recompute, mark_dirty, rating_update_stats, sweep_dirty_ratings
+from .rollups import rebuild_daily_ratings
+from .spool import FeedbackSpool, SpoolFull, forward_entries
+from .stars import STAR_FIELDS
+
+
+class LessonListQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(
+            username='teacher', role='teacher', institute=cls.institute, surname='Teacher', visible_reviews=True,
+        )
+        cls.subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def add_lessons(self, count, feedback_per_lesson=3):
+        now = timezone.now()
+        for index in range(count):
+            lesson = Lesson.objects.create(
+                teacher=self.teacher, institute=self.institute, subject=self.subject,
+                topic=f'Lesson {index}', location='101',
+                start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1),
+            )
+            StudentFeedback.objects.bulk_create([
+                StudentFeedback(
+                    lesson=lesson, teacher=self.teacher, subject=self.subject, institute=self.institute,
+                    student_name=f'Student {number}', rating=5, praises=['clear'],
+                )
+                for number in range(feedback_per_lesson)
+            ])
+
+    def assert_constant_queries(self, url, queries):
+        for count in (2, 8):
+            self.add_lessons(count)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_teacher_lesson_list(self):
+        self.assert_constant_queries(reverse('lessons:teacher-lessons-list'), 1)
+
+    def test_teacher_lesson_list_with_feedback(self):
+        # Отзывы подгружаются одним запросом на страницу, а не на урок
+        url = reverse('lessons:teacher-lessons-list') + '?fields=id,student_feedback_count,student_feedback'
+        self.assert_constant_queries(url, 2)
+
+    def test_teacher_lesson_list_by_id(self):
+        url = reverse('lessons:teacher-lessons-by-id', kwargs={'id': self.teacher.pk})
+        self.assert_constant_queries(url, 5)
+
+    def test_teacher_lesson_list_renders_feedback(self):
+        self.add_lessons(2)
+        url = reverse('lessons:teacher-lessons-list') + '?fields=id,student_feedback_count,student_feedback'
+        response = self.client.get(url)
+        self.assertEqual([lesson['student_feedback_count'] for lesson in response.data], [3, 3])
+        self.assertEqual([len(lesson['student_feedback']) for lesson in response.data], [3, 3])
+
+
+    def test_list_is_compact_by_default(self):
+        self.add_lessons(1)
+        lesson = self.client.get(reverse('lessons:teacher-lessons-list')).data[0]
+        self.assertNotIn('qr_code_base64', lesson)
+        self.assertNotIn('student_feedback', lesson)
+        self.assertIn('rating_distribution', lesson)
+
+    def test_sparse_fields_prune_columns(self):
+        self.add_lessons(1)
+        url = reverse('lessons:teacher-lessons-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,topic'})
+        self.assertEqual(set(response.data[0]), {'id', 'topic'})
+        self.assertNotIn('location', queries[0]['sql'])
+
+        response = self.client.get(url, {'exclude': 'location,rating_distribution'})
+        self.assertNotIn('location', response.data[0])
+        self.assertNotIn('rating_distribution', response.data[0])
+        self.assertIn('topic', response.data[0])
+
+class PraiseAggregationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        ingest_feedbacks([
+            {'lesson': cls.lesson.pk, 'student_name': 'First', 'rating': 5, 'praises': ['clear', 'fun']},
+            {'lesson': cls.lesson.pk, 'student_name': 'Second', 'rating': 4, 'praises': ['fun']},
+            {'lesson': cls.lesson.pk, 'student_name': 'Third', 'rating': 2, 'praises': ['slow', 'boring']},
+            {'lesson': cls.lesson.pk, 'student_name': 'Fourth', 'rating': 1, 'praises': ['slow']},
+        ])
+
+    def test_top_praises_splits_by_rating_and_breaks_ties_by_name(self):
+        rows = [('fun', 5, 2), ('clear', 4, 2), ('slow', 2, 1), ('boring', 1, 1)]
+        self.assertEqual(top_praises(rows, 4), ('clear', 'boring'))
+        self.assertEqual(top_praises([], 4), (None, None))
+
+    def test_teacher_counters_match_feedback(self):
+        self.assertEqual(teacher_top_praises(self.teacher.pk, 3), ('fun', 'slow'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Praises are unnested with jsonb functions')
+    def test_database_counts_match_feedback(self):
+        StudentFeedback.objects.filter(student_name='Fourth').update(praises={'not': 'a list'})
+        rows = praise_counts(StudentFeedback.objects.filter(lesson=self.lesson))
+        self.assertEqual(
+            sorted(rows), [('boring', 2, 1), ('clear', 5, 1), ('fun', 4, 1), ('fun', 5, 1), ('slow', 2, 1)],
+        )
+
+    def test_malformed_date_filter_is_rejected(self):
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        url = reverse('lessons:teacher-lessons-by-id', kwargs={'id': self.teacher.pk})
+        self.assertEqual(client.get(url, {'start_date': 'yesterday'}).status_code, 400)
+        response = client.get(url)
+        self.assertEqual(response.data['teacher']['most_frequent_praise'], 'fun')
+        self.assertEqual(response.data['teacher']['most_frequent_criticism'], 'slow')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are only checked on PostgreSQL')
+class HotQueryPlansTest(TestCase):
+    expected_indexes = {
+        'feedback list by date': 'feedback_created_idx',
+        'feedback of lesson by date': 'feedback_lesson_created_idx',
+        'feedback of teacher by date': 'feedback_teacher_created_idx',
+        'teacher lessons by start time': 'lesson_teacher_start_idx',
+        'teacher lessons by rating': 'lesson_teacher_rating_idx',
+        'best lessons of subject': 'lesson_subject_rated_idx',
+        'best lessons of institute': 'lesson_institute_rated_idx',
+        'best teachers of institute': 'user_institute_role_rating_idx',
+        'leaderboard of subject': 'unique_leaderboard_member',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1),
+        )
+
+    def test_hot_queries_use_indexes(self):
+        queries = hot_queries(
+            self.lesson.pk, self.lesson.teacher_id, self.lesson.subject_id, self.lesson.institute_id,
+        )
+        self.assertEqual(set(queries), set(self.expected_indexes))
+        for name, queryset in queries.items():
+            with self.subTest(name), transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+                self.assertNotIn('Seq Scan', plan)
+                self.assertIn(self.expected_indexes[name], plan)
+
+
+class LessonQRCodeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+        lesson_code_cache.invalidate(self.lesson.unique_code)
+        self.url = reverse('lessons:generate-qr-code', kwargs={'unique_code': self.lesson.unique_code})
+
+    def test_default_png_is_served_from_stored_image(self):
+        LessonQRCode.objects.create(lesson=self.lesson, image=b'stored')
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'stored')
+
+    def test_other_sizes_are_rendered_from_form_url(self):
+        LessonQRCode.objects.create(lesson=self.lesson, image=b'stored')
+        response = self.client.get(self.url, {'size': settings.QR_DEFAULT_SIZE + 10})
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+    def test_rendered_images_are_cached(self):
+        params = {'size': settings.QR_DEFAULT_SIZE + 10, 'format': 'svg'}
+        with patch('lessons.qr.render_qr', return_value=b'<svg/>') as render:
+            first = self.client.get(self.url, params)
+            second = self.client.get(self.url, params)
+        render.assert_called_once()
+        self.assertEqual(first.content, second.content)
+        self.assertIn(f'max-age={settings.QR_CACHE_MAX_AGE}', second['Cache-Control'])
+        self.assertIn('Accept', second['Vary'])
+
+    def test_conditional_request_skips_rendering(self):
+        etag = self.client.get(self.url, {'format': 'svg'})['ETag']
+        cache.clear()
+        with patch('lessons.qr.render_qr') as render:
+            response = self.client.get(self.url, {'format': 'svg'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_png_is_default_for_browser_accept(self):
+        accept = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT=accept)['Content-Type'], 'image/png')
+        self.assertEqual(self.client.get(self.url, {'format': 'svg'})['Content-Type'], 'image/svg+xml')
+        preferred = 'image/svg+xml, image/*;q=0.5'
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT=preferred)['Content-Type'], 'image/svg+xml')
+
+    def test_create_returns_qr_code(self):
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        now = timezone.now()
+        with patch('lessons.views.generate_lesson_qr.delay'):
+            response = client.post(reverse('lessons:lesson-create'), {
+                'teacher': self.teacher.pk, 'institute': self.lesson.institute_id, 'subject': self.lesson.subject_id,
+                'topic': 'New', 'location': '102',
+                'start_time': now.isoformat(), 'end_time': (now + timedelta(hours=1)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(base64.b64decode(response.data['qr_code']).startswith(b'\x89PNG'))
+        self.assertIn(str(response.data['unique_code']), response.data['qr_code_url'])
+
+
+class LessonCodeCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        cls.teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=cls.teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=cls.teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now - timedelta(minutes=5),
+        )
+
+    def setUp(self):
+        lesson_code_cache.invalidate(self.lesson.unique_code)
+        self.url = reverse('lessons:lesson-by-code', kwargs={'unique_code': self.lesson.unique_code})
+
+    def test_repeated_lookup_hits_cache(self):
+        self.lesson.end_time = timezone.now() + timedelta(hours=1)
+        self.lesson.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['topic'], 'Lesson')
+
+    def test_extending_lesson_invalidates_window(self):
+        feedback_url = reverse('lessons:student-feedback', kwargs={'unique_code': self.lesson.unique_code})
+        response = self.client.post(feedback_url, {'student_name': 'Student', 'rating': 5}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        response = client.patch(f'/api/lessons/{self.lesson.unique_code}/increase-time/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(lesson_code_cache.get(self.lesson.unique_code).is_link_active())
+
+    def test_unknown_code_is_cached_as_missing(self):
+        url = reverse('lessons:lesson-by-code', kwargs={'unique_code': '00000000-0000-0000-0000-000000000000'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RatingMaintenanceTest(TestCase):
+    maxDiff = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institute = Institute.objects.create(name='Institute')
+        cls.first = User.objects.create(username='first', role='teacher', institute=cls.institute, surname='First')
+        cls.second = User.objects.create(username='second', role='teacher', institute=cls.institute, surname='Second')
+        cls.first_subject = Subject.objects.create(name='First', teacher=cls.first)
+        cls.second_subject = Subject.objects.create(name='Second', teacher=cls.second)
+        cls.first_lesson = cls.add_lesson(cls.first, cls.first_subject)
+        cls.second_lesson = cls.add_lesson(cls.second, cls.second_subject)
+
+    @classmethod
+    def add_lesson(cls, teacher, subject):
+        now = timezone.now()
+        return Lesson.objects.create(
+            teacher=teacher, institute=cls.institute, subject=subject, topic=f'{subject.name} lesson',
+            location='101', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+
+    def feed(self, lesson, *ratings, praises=('clear',)):
+        ingest_feedbacks([
+            {'lesson': lesson.pk, 'student_name': f'Student {index}', 'rating': rating, 'praises': list(praises)}
+            for index, rating in enumerate(ratings)
+        ])
+
+    def snapshot(self):
+        rating_fields = ('rating_sum', 'feedback_count', 'average_rating', *STAR_FIELDS)
+        state = {
+            'lessons': list(Lesson.objects.order_by('id').values_list('id', *rating_fields)),
+            'subjects': list(Subject.objects.order_by('id').values_list(
+                'id', 'rating', 'lesson_rating_sum', 'rated_lesson_count', *STAR_FIELDS
+            )),
+            'teachers': list(User.objects.order_by('id').values_list(
+                'id', 'rating', 'subject_rating_sum', 'rated_subject_count', 'feedback_count', *STAR_FIELDS
+            )),
+            'institutes': list(Institute.objects.order_by('id').values_list(
+                'id', 'rating', 'teacher_rating_sum', 'rated_teacher_count', *STAR_FIELDS
+            )),
+            'leaderboards': set(LeaderboardEntry.objects.values_list(
+                'scope_type', 'scope_id', 'side', 'member_id', 'name', 'rating'
+            )),
+            'days': set(DailyRating.objects.exclude(feedback_count=0).values_list(
+                'entity_type', 'entity_id', 'day', 'feedback_count', 'rating_sum', *STAR_FIELDS
+            )),
+            'praises': set(TeacherPraiseCounter.objects.exclude(count=0).values_list(
+                'teacher_id', 'praise', 'rating', 'count'
+            )),
+        }
+        return {
+            name: type(rows)(
+                tuple(round(value, 6) if isinstance(value, float) else value for value in row) for row in rows
+            )
+            for name, rows in state.items()
+        }
+
+    def assert_matches_recompute(self):
+        sweep_dirty_ratings(1000)
+        incremental = self.snapshot()
+        bulk_recompute()
+        rebuild_daily_ratings()
+        rebuild_praise_counters()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_recalculate_ratings_command_repairs_drift(self):
+        self.feed(self.first_lesson, 3, 4, 5)
+        self.feed(self.second_lesson, 1, 2)
+        expected = self.snapshot()
+        Lesson.objects.update(average_rating=0, rating_sum=0, feedback_count=0, stars_5=0)
+        Subject.objects.update(rating=0, lesson_rating_sum=0, rated_lesson_count=0)
+        User.objects.update(rating=0, feedback_count=0, stars_1=9)
+        Institute.objects.update(rating=0, teacher_rating_sum=0, rated_teacher_count=0)
+        stdout = StringIO()
+        call_command('recalculate_ratings', institute=self.institute.pk, stdout=stdout)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertIn('institutes: 1 rows', stdout.getvalue())
+
+    def test_create(self):
+        self.feed(self.first_lesson, 3, 4, 5)
+        self.feed(self.second_lesson, 1, 2)
+        self.assert_matches_recompute()
+
+    def test_edit_and_delete_feedback(self):
+        self.feed(self.first_lesson, 3, 4, 5)
+        self.feed(self.second_lesson, 1, 2)
+        feedback = StudentFeedback.objects.filter(lesson=self.first_lesson, rating=5).get()
+        feedback.rating = 1
+        feedback.praises = ['clear', 'loud']
+        feedback.save()
+        StudentFeedback.objects.filter(lesson=self.second_lesson, rating=2).get().delete()
+        self.assertEqual(
+            set(TeacherPraiseCounter.objects.filter(teacher=self.first, count__gt=0).values_list(
+                'praise', 'rating', 'count'
+            )),
+            {('clear', 3, 1), ('clear', 4, 1), ('clear', 1, 1), ('loud', 1, 1)},
+        )
+        self.assert_matches_recompute()
+
+    def test_lesson_move(self):
+        self.feed(self.first_lesson, 3, 5)
+        self.feed(self.second_lesson, 2)
+        self.first_lesson.teacher = self.second
+        self.first_lesson.subject = self.second_subject
+        self.first_lesson.save()
+        self.assertEqual(
+            set(StudentFeedback.objects.filter(lesson=self.first_lesson).values_list(
+                'teacher_id', 'subject_id', 'institute_id'
+            )),
+            {(self.second.pk, self.second_subject.pk, self.institute.pk)},
+        )
+        self.assert_matches_recompute()
+
+    def test_feedback_copies_lesson_hierarchy(self):
+        self.feed(self.first_lesson, 4)
+        self.assertEqual(
+            list(StudentFeedback.objects.values_list('teacher_id', 'subject_id', 'institute_id')),
+            [(self.first.pk, self.first_subject.pk, self.institute.pk)],
+        )
+
+    @override_settings(LEADERBOARD_SIZE=2)
+    def test_full_leaderboards_are_refilled(self):
+        lessons = [self.first_lesson] + [self.add_lesson(self.first, self.first_subject) for _ in range(3)]
+        for rating, lesson in enumerate(lessons, start=1):
+            self.feed(lesson, rating)
+        self.feed(self.second_lesson, 3)
+        self.assertTrue(LeaderboardScope.objects.filter(scope_type='subject', scope_id=self.first_subject.pk).exists())
+        lessons[-1].delete()
+        self.feed(lessons[0], 5, 5)
+        self.assert_matches_recompute()
+
+    def test_batch_queries_do_not_grow_with_feedback(self):
+        self.feed(self.first_lesson, 4)
+        self.feed(self.second_lesson, 2)
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as queries:
+                self.feed(self.first_lesson, *[4] * size)
+                self.feed(self.second_lesson, *[2] * size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assert_matches_recompute()
+
+    def test_teacher_delete_retracts_institute(self):
+        self.feed(self.first_lesson, 3)
+        self.feed(self.second_lesson, 2)
+        self.institute.refresh_from_db()
+        self.assertEqual(self.institute.rating, 2.5)
+
+        self.first.delete()
+        self.institute.refresh_from_db()
+        self.assertEqual(
+            (self.institute.rating, self.institute.teacher_rating_sum, self.institute.rated_teacher_count),
+            (2.0, 2.0, 1),
+        )
+        self.assert_matches_recompute()
+
+    def test_lesson_delete_retracts_averages(self):
+        self.feed(self.first_lesson, 5)
+        self.feed(self.add_lesson(self.first, self.first_subject), 1)
+        self.feed(self.second_lesson, 2)
+        self.first_lesson.delete()
+        self.first.refresh_from_db()
+        self.institute.refresh_from_db()
+        self.assertEqual((self.first.rating, self.institute.rating), (1.0, 1.5))
+        self.assert_matches_recompute()
+
+    def test_teacher_delete_retracts_lessons_in_other_subjects(self):
+        self.feed(self.second_lesson, 2)
+        self.feed(self.add_lesson(self.first, self.second_subject), 4)
+        self.first.delete()
+        self.second_subject.refresh_from_db()
+        self.assertEqual(self.second_subject.rating, 2.0)
+        self.assert_matches_recompute()
+
+    def test_subject_and_institute_delete(self):
+        self.feed(self.first_lesson, 4)
+        self.feed(self.second_lesson, 2)
+        self.second_subject.delete()
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.rating, 0)
+        self.assert_matches_recompute()
+        Institute.objects.all().delete()
+        self.assert_matches_recompute()
+
+
+class DirtyRatingCoalescingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=teacher)
+        now = timezone.now()
+        cls.lesson = Lesson.objects.create(
+            teacher=teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_marks_are_recomputed_once(self):
+        for _ in range(3):
+            mark_dirty(lessons=[self.lesson.pk])
+        self.assertEqual(sweep_dirty_ratings(100, window=60), (0, {
+            'lesson': 0, 'subject': 0, 'teacher': 0, 'institute': 0,
+        }))
+        claimed, recomputed = sweep_dirty_ratings(100)
+        self.assertEqual((claimed, recomputed['lesson']), (1, 1))
+        stats = rating_update_stats()['lesson']
+        self.assertEqual((stats['marked'], stats['coalesced'], stats['recomputed']), (1, 2, 1))
+
+
+class FeedbackAdmissionTest(TestCase):
+    def setUp(self):
+        self.admission = FeedbackAdmission(
+            class_size=10, per_minute=60, client_burst=3, client_per_minute=6,
+            seen_capacity=100, seen_error_rate=0.001, max_lessons=4,
+        )
+
+    def test_one_client_cannot_exhaust_another_clients_bucket(self):
+        verdicts = [self.admission.admit(1, 'noisy', f'Student {index}') for index in range(5)]
+        self.assertEqual(verdicts, [ADMITTED] * 3 + [FLOOD] * 2)
+        self.assertEqual(self.admission.admit(1, 'quiet', 'Student'), ADMITTED)
+        self.assertEqual(self.admission.admit(2, 'noisy', 'Student'), ADMITTED)
+
+    def test_lesson_bucket_caps_all_clients(self):
+        verdicts = [self.admission.admit(1, f'client {index}', 'Student') for index in range(12)]
+        self.assertEqual(verdicts, [ADMITTED] * 10 + [FLOOD] * 2)
+
+    def test_duplicate_is_rejected(self):
+        self.admission.remember(1, 'client', 'Student')
+        self.assertEqual(self.admission.admit(1, 'client', ' student '), DUPLICATE)
+        self.assertEqual(self.admission.admit(1, 'client', 'Other'), ADMITTED)
+
+
+class FeedbackSpoolTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        institute = Institute.objects.create(name='Institute')
+        teacher = User.objects.create(username='teacher', role='teacher', institute=institute, surname='Teacher')
+        subject = Subject.objects.create(name='Subject', teacher=teacher)
+        now = timezone.now()
+        # Окно урока закрылось, пока отзывы лежали в спуле
+        cls.lesson = Lesson.objects.create(
+            teacher=teacher, institute=institute, subject=subject, topic='Lesson', location='101',
+            start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1),
+        )
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.spool = FeedbackSpool(f'{directory}/spool.sqlite3', max_entries=3)
+
+    def test_replay_stores_valid_entries_and_buries_bad_ones(self):
+        self.spool.append({'lesson': self.lesson.pk, 'student_name': 'First', 'rating': 5})
+        self.spool.append({'lesson': self.lesson.pk, 'student_name': 'Second', 'rating': 4})
+        self.spool.append({'lesson': self.lesson.pk, 'student_name': 'Broken', 'rating': 9})
+        with self.assertRaises(SpoolFull):
+            self.spool.append({'lesson': self.lesson.pk, 'student_name': 'Late', 'rating': 5})
+
+        entries = self.spool.read(10)
+        rejected = forward_entries(entries, 'database')
+        self.spool.bury(rejected)
+        self.spool.remove_through(entries[-1][0])
+
+        self.assertEqual(
+            sorted(StudentFeedback.objects.filter(lesson=self.lesson).values_list('student_name', flat=True)),
+            ['First', 'Second'],
+        )
+        self.assertEqual([payload['student_name'] for payload, _ in rejected], ['Broken'])
+        self.assertEqual(self.spool.size(), 0)
+        self.assertEqual(self.spool.connection.execute('SELECT COUNT(*) FROM dead_entries').fetchone(), (1,))
+
+    def test_broker_replay_skips_window_check(self):
+        self.spool.append({'lesson': self.lesson.pk, 'student_name': 'First', 'rating': 5})
+        with patch('lessons.spool.publish_feedback') as publish:
+            self.assertEqual(forward_entries(self.spool.read(10), 'broker'), [])
+        publish.assert_called_once_with(
+            {'lesson': self.lesson.pk, 'student_name': 'First', 'rating': 5, 'window_checked': True}
+        )
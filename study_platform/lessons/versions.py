@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.db import transaction
+
+GLOBAL_VERSION_KEY = 'rating_version:all'
+
+
+def version_key(entity_type, entity_id):
+    return f'rating_version:{entity_type}:{entity_id}'
+
+
+def get_versions(entity_type, entity_id):
+    key = version_key(entity_type, entity_id)
+    values = cache.get_many([GLOBAL_VERSION_KEY, key])
+    return values.get(GLOBAL_VERSION_KEY, 0), values.get(key, 0)
+
+
+def _bump(keys):
+    for key in keys:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def bump_versions(*entities, everything=False):
+    keys = {version_key(entity_type, entity_id) for entity_type, entity_id in entities if entity_id is not None}
+    if everything:
+        keys.add(GLOBAL_VERSION_KEY)
+    if keys:
+        # Версию поднимаем только после коммита, иначе читатель успеет закешировать старые данные под новой версией
+        transaction.on_commit(lambda: _bump(keys))
@@ -1,26 +1,38 @@
-import io
 import base64
 from datetime import timedelta
 
+from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework import generics, filters, status
 from rest_framework.response import Response
-import qrcode 
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
-from django.utils.timezone import localtime
 
 
-from .serializers import LessonSerializer, StudentFeedbackSerializer
-from .models import Lesson, StudentFeedback
+from .serializers import (
+    LessonSerializer,
+    StudentFeedbackSerializer,
+    StudentFeedbackInputSerializer,
+    DateRangeSerializer,
+)
+from .models import Lesson
 from accounts.models import User
-from .tasks import process_feedback
+from .tasks import generate_lesson_qr, process_feedback
+from .ingest import publish_feedback
+from .spool import SpoolFull, feedback_spool
+from .cache import get_lesson_window, lesson_code_cache
+from .qr import QR_FORMATS, feedback_form_url, get_qr_image, negotiate_format, negotiate_size, qr_digest
+from .praises import teacher_top_praises
+from .admission import DUPLICATE, FLOOD, client_fingerprint, feedback_admission
 from accounts.pagination import Pagination
+from app.reports import build_teacher_report, report_filename
+from app.serializers import ReportRequestSerializer
+from app.utils import excel_response, get_top_praises
 
 class LessonCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
@@ -28,21 +40,17 @@ class LessonCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         lesson = serializer.save(teacher=self.request.user)
-        feedback_url = self.request.build_absolute_uri(
-            reverse('lessons:student-feedback', kwargs={'unique_code': lesson.unique_code})
-        )
-
-        img = qrcode.make(feedback_url)
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        qr_code_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        lesson.qr_code_base64 = qr_code_base64
-        lesson.save()
-        self.qr_code_base64 = qr_code_base64
+        transaction.on_commit(lambda: generate_lesson_qr.delay(lesson.id))
 
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
-        response.data['qr_code'] = self.qr_code_base64
+        unique_code = response.data['unique_code']
+        response.data['qr_code_url'] = request.build_absolute_uri(
+            reverse('lessons:generate-qr-code', kwargs={'unique_code': unique_code})
+        )
+        # Поле оставлено для старых клиентов, новым достаточно qr_code_url
+        image = get_qr_image(feedback_form_url(unique_code), 'png', settings.QR_DEFAULT_SIZE)
+        response.data['qr_code'] = base64.b64encode(image).decode('utf-8')
         return response
     
     def get_serializer_context(self):
@@ -105,11 +113,18 @@ class LessonByCodeView(generics.RetrieveAPIView):
         return context
 
     def get(self, request, *args, **kwargs):
-        lesson = self.get_object()
-        if not lesson.is_link_active():
+        unique_code = kwargs['unique_code']
+        window = get_lesson_window(unique_code)
+        if window is None:
+            raise Http404
+        if not window.is_link_active():
             return Response({'error': 'Link is not active'}, status=status.HTTP_400_BAD_REQUEST)
-        serializer = self.get_serializer(lesson)
-        return Response(serializer.data)
+        params = request.query_params
+        if 'fields' in params or 'exclude' in params or LessonSerializer.can_see_feedback(request):
+            return Response(self.get_serializer(self.get_object()).data)
+        return Response(lesson_code_cache.get_data(
+            unique_code, lambda: dict(self.get_serializer(self.get_object()).data)
+        ))
 
 
 class TeacherLessonListView(generics.ListAPIView):
@@ -121,11 +136,13 @@ class TeacherLessonListView(generics.ListAPIView):
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context.update({"request": self.request})
+        context.update({"request": self.request, "compact": True})
         return context
 
     def get_queryset(self):
-        return Lesson.objects.filter(teacher=self.request.user)
+        return LessonSerializer.setup_eager_loading(
+            Lesson.objects.filter(teacher=self.request.user), self.request, compact=True
+        )
     
 
 
@@ -138,29 +155,30 @@ class TeacherLessonListByIdView(generics.ListAPIView):
     search_fields = ['topic']
     ordering_fields = ['average_rating', 'start_time']
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update({"compact": True})
+        return context
+
     def get_queryset(self):
-        return Lesson.objects.filter(teacher_id=self.kwargs['id'])
+        return LessonSerializer.setup_eager_loading(
+            Lesson.objects.filter(teacher_id=self.kwargs['id']), self.request, compact=True
+        )
 
     def list(self, request, *args, **kwargs):
+        dates = DateRangeSerializer(data=request.query_params)
+        dates.is_valid(raise_exception=True)
+        teacher = get_object_or_404(User, id=self.kwargs['id'], role='teacher')
         response = super().list(request, *args, **kwargs)
-        teacher_id = self.kwargs['id']
-        teacher = User.objects.get(id=teacher_id, role='teacher')
-        feedbacks = StudentFeedback.objects.filter(lesson__teacher=teacher)
-        good_counts = {}
-        bad_counts = {}
-
-        for fb in feedbacks:
-            if not fb.praises:
-                continue
-            if fb.rating >= 3:
-                for p in fb.praises:
-                    good_counts[p] = good_counts.get(p, 0) + 1
-            else:
-                for p in fb.praises:
-                    bad_counts[p] = bad_counts.get(p, 0) + 1
-
-        most_frequent_praise = max(good_counts, key=good_counts.get) if good_counts else None
-        most_frequent_criticism = max(bad_counts, key=bad_counts.get) if bad_counts else None
+        start_date = dates.validated_data.get('start_date')
+        end_date = dates.validated_data.get('end_date')
+        if start_date or end_date:
+            most_frequent_praise, most_frequent_criticism = get_top_praises(
+                start_date and start_date.isoformat(), end_date and end_date.isoformat(),
+                'teacher', teacher, good_from=3,
+            )
+        else:
+            most_frequent_praise, most_frequent_criticism = teacher_top_praises(teacher.id, 3)
 
         response.data['teacher'] = {
             'id': teacher.id,
@@ -180,21 +198,43 @@ class StudentFeedbackCreateView(generics.CreateAPIView):
     serializer_class = StudentFeedbackSerializer
 
     def post(self, request, *args, **kwargs):
-        lesson_code = kwargs.get('unique_code')
-        try:
-            lesson = Lesson.objects.get(unique_code=lesson_code)
-            if not lesson.is_link_active():
-                return Response({'error': 'Link is not active'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            feedback_data = request.data.copy()
-            feedback_data['lesson'] = lesson.id
+        lesson = get_lesson_window(kwargs.get('unique_code'))
+        if lesson is None:
+            return Response({'error': 'Invalid lesson code'}, status=status.HTTP_404_NOT_FOUND)
+        if not lesson.is_link_active():
+            return Response({'error': 'Link is not active'}, status=status.HTTP_400_BAD_REQUEST)
 
-            process_feedback.delay(feedback_data)
+        client = client_fingerprint(request)
+        student_name = request.data.get('student_name', '')
+        verdict = feedback_admission.admit(lesson.id, client, student_name)
+        if verdict == DUPLICATE:
+            return Response({'error': 'Feedback already submitted'}, status=status.HTTP_409_CONFLICT)
+        if verdict == FLOOD:
+            return Response(
+                {'error': 'Too many feedback submissions, try again later'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(feedback_admission.retry_after)},
+            )
 
-            return Response({'message': 'Feedback received and will be processed shortly.'}, status=status.HTTP_202_ACCEPTED)
+        serializer = StudentFeedbackInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        feedback_data = {**serializer.validated_data, 'lesson': lesson.id}
+
+        if settings.FEEDBACK_INGESTION == 'spool':
+            try:
+                feedback_spool.append(feedback_data)
+            except SpoolFull:
+                return Response(
+                    {'error': 'Feedback queue is full, try again later'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+        elif settings.FEEDBACK_INGESTION == 'batch':
+            publish_feedback(feedback_data)
+        else:
+            process_feedback.delay(feedback_data)
 
-        except Lesson.DoesNotExist:
-            return Response({'error': 'Invalid lesson code'}, status=status.HTTP_404_NOT_FOUND)
+        feedback_admission.remember(lesson.id, client, student_name)
+        return Response({'message': 'Feedback received and will be processed shortly.'}, status=status.HTTP_202_ACCEPTED)
 
 class IncreaseTimeView(APIView):
     permission_classes = [IsAuthenticated]
@@ -218,12 +258,20 @@ class IncreaseTimeView(APIView):
         
 
 def generate_qr_code(request, unique_code):
-    lesson = get_object_or_404(Lesson, unique_code=unique_code)
-    frontend_base_url = "http://localhost:5173"  
-    url = f"{frontend_base_url}/form/{lesson.unique_code}/"
-    img = qrcode.make(url)
-    response = HttpResponse(content_type="image/png")
-    img.save(response, "PNG")
+    window = get_lesson_window(unique_code)
+    if window is None:
+        raise Http404
+    fmt = negotiate_format(request)
+    size = negotiate_size(request)
+    content = feedback_form_url(unique_code)
+    etag = f'"{qr_digest(content, fmt, size)}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(get_qr_image(content, fmt, size, window.id), content_type=QR_FORMATS[fmt])
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.QR_CACHE_MAX_AGE)
+    patch_vary_headers(response, ['Accept'])
     return response
 
 
@@ -232,102 +280,9 @@ class TeacherExcelReportView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, id):
-        teacher = User.objects.get(id=id, role='teacher')
-        feedbacks = StudentFeedback.objects.filter(lesson__teacher=teacher)
-
-        good_counts = {}
-        bad_counts = {}
-
-        for fb in feedbacks:
-            if not fb.praises:
-                continue
-            if fb.rating >= 4:
-                for p in fb.praises:
-                    good_counts[p] = good_counts.get(p, 0) + 1
-            else:
-                for p in fb.praises:
-                    bad_counts[p] = bad_counts.get(p, 0) + 1
-
-        most_frequent_praise = max(good_counts, key=good_counts.get) if good_counts else None
-        most_frequent_criticism = max(bad_counts, key=bad_counts.get) if bad_counts else None
-
-        institute_name = teacher.institute.name if teacher.institute else ''
-        total_reviews = teacher.feedback_count
-        rating = teacher.rating or 0.0
-
-        wb = Workbook()
-
-        ws1 = wb.active
-        ws1.title = "Основная информация"
-
-        ws1.append(["ФИО преподавателя", "Рейтинг", "Институт", "Топ 2 мини-отзыва", "Количество оценок"])
-
-        fio = f"{teacher.first_name or ''} {teacher.surname or ''} {teacher.last_name or ''}".strip()
-
-        top_reviews = []
-        if most_frequent_praise:
-            top_reviews.append(most_frequent_praise)
-        if most_frequent_criticism:
-            top_reviews.append(most_frequent_criticism)
-
-        row_values = [fio, rating, institute_name, ", ".join(top_reviews), total_reviews]
-        ws1.append(row_values)
-
-        top_reviews_cell = ws1.cell(row=2, column=4)
-        parts = top_reviews_cell.value.split(", ") if top_reviews_cell.value else []
-
-        ws1.delete_cols(4)
-        ws1.cell(row=1, column=4, value="Похвала")
-        ws1.cell(row=1, column=5, value="Критика")
-        ws1.cell(row=1, column=6, value="Количество оценок")
-
-        ws1.cell(row=2, column=1, value=fio)
-        ws1.cell(row=2, column=2, value=rating)
-        ws1.cell(row=2, column=3, value=institute_name)
-        ws1.cell(row=2, column=6, value=total_reviews)
-
-        praise_cell = ws1.cell(row=2, column=4, value=most_frequent_praise if most_frequent_praise else '')
-        criticism_cell = ws1.cell(row=2, column=5, value=most_frequent_criticism if most_frequent_criticism else '')
-
-        green_fill = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid')
-        red_fill = PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
-
-        if most_frequent_praise:
-            praise_cell.fill = green_fill
-        if most_frequent_criticism:
-            criticism_cell.fill = red_fill
-
-        ws2 = wb.create_sheet("Отзывы")
-
-        # Добавляем ещё одну колонку после "Результат" для praises
-        ws2.append(["Студент", "Предмет", "Пара (Тема)", "Дата и время", "Комментарий", "Оценка", "Результат", "Praises"])
-
-        teacher_lessons = Lesson.objects.filter(teacher=teacher)
-        feedbacks = StudentFeedback.objects.filter(lesson__in=teacher_lessons).select_related('lesson', 'lesson__subject')
-
-        for fb in feedbacks:
-            dt = localtime(fb.created_at).strftime('%Y-%m-%d %H:%M:%S')
-            result_text = "Понравилось" if fb.rating >= 4 else "Не понравилось"
-            praises_str = ", ".join(fb.praises) if fb.praises else ''
-            ws2.append([
-                fb.student_name,
-                fb.lesson.subject.name if fb.lesson.subject else '',
-                fb.lesson.topic,
-                dt,
-                fb.comment,
-                fb.rating,
-                result_text,
-                praises_str
-            ])
-
-        from io import BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        filename = f"report_teacher_{teacher.id}.xlsx"
-
-        response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
+        serializer = ReportRequestSerializer(data={**request.query_params.dict(), 'kind': 'teacher', 'teacher_id': id})
+        serializer.is_valid(raise_exception=True)
+        params = serializer.report_params()
+        wb = build_teacher_report(params)
+        return excel_response(wb, report_filename('teacher', params))
 
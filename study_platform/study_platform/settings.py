@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +77,13 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': (
@@ -142,8 +150,86 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Yekaterinburg'
 
 CELERY_BEAT_SCHEDULE = {
-    'recalculate_all_ratings': {
-        'task': 'lessons.tasks.recalculate_all_ratings',
+    'recalculate_dirty_ratings': {
+        'task': 'lessons.tasks.recalculate_dirty_ratings',
         'schedule': 30.0,
     },
+    'purge_expired_reports': {
+        'task': 'app.tasks.purge_expired_reports',
+        'schedule': 3600.0,
+    },
+}
+
+RATING_SWEEP_BATCH_SIZE = 5000
+
+# Сколько секунд отметка о пересчёте копит повторные изменения той же сущности до пересчёта
+RATING_COALESCE_WINDOW = int(os.environ.get("RATING_COALESCE_WINDOW", 10))
+
+# celery — задача на каждый отзыв, batch — очередь feedback и consume_feedback,
+# spool — локальный журнал и drain_feedback_spool
+FEEDBACK_INGESTION = os.environ.get("FEEDBACK_INGESTION", "celery")
+
+FEEDBACK_BATCH_SIZE = int(os.environ.get("FEEDBACK_BATCH_SIZE", 200))
+
+FEEDBACK_BATCH_MAX_WAIT_MS = int(os.environ.get("FEEDBACK_BATCH_MAX_WAIT_MS", 500))
+
+FEEDBACK_SPOOL_PATH = os.environ.get("FEEDBACK_SPOOL_PATH", BASE_DIR / 'spool' / 'feedback.sqlite3')
+
+# always — fsync на каждую запись, batch — на контрольных точках WAL, off — без fsync
+FEEDBACK_SPOOL_FSYNC = os.environ.get("FEEDBACK_SPOOL_FSYNC", "batch")
+
+FEEDBACK_SPOOL_MAX_ENTRIES = int(os.environ.get("FEEDBACK_SPOOL_MAX_ENTRIES", 100000))
+
+FEEDBACK_SPOOL_TARGET = os.environ.get("FEEDBACK_SPOOL_TARGET", "database")
+
+RATING_SEARCH_CACHE_TTL = int(os.environ.get("RATING_SEARCH_CACHE_TTL", 3600))
+
+# сколько лучших и худших участников хранить в каждой доске рейтинга
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 10))
+
+LESSON_CODE_CACHE_SIZE = int(os.environ.get("LESSON_CODE_CACHE_SIZE", 1024))
+
+LESSON_CODE_CACHE_TTL = int(os.environ.get("LESSON_CODE_CACHE_TTL", 10))
+
+# ожидаемый размер группы — столько отзывов на урок принимается без ограничения скорости
+FEEDBACK_CLASS_SIZE = int(os.environ.get("FEEDBACK_CLASS_SIZE", 60))
+
+FEEDBACK_RATE_PER_MINUTE = int(os.environ.get("FEEDBACK_RATE_PER_MINUTE", 60))
+
+# один клиент урока: несколько повторов подряд, дальше не чаще раза в десять секунд
+FEEDBACK_CLIENT_BURST = int(os.environ.get("FEEDBACK_CLIENT_BURST", 5))
+
+FEEDBACK_CLIENT_RATE_PER_MINUTE = int(os.environ.get("FEEDBACK_CLIENT_RATE_PER_MINUTE", 6))
+
+# адреса обратных прокси, которым доверяем X-Forwarded-For
+TRUSTED_PROXIES = {
+    address.strip() for address in os.environ.get("TRUSTED_PROXIES", "").split(',') if address.strip()
 }
+
+FEEDBACK_SEEN_CAPACITY = int(os.environ.get("FEEDBACK_SEEN_CAPACITY", 2000))
+
+FEEDBACK_SEEN_ERROR_RATE = float(os.environ.get("FEEDBACK_SEEN_ERROR_RATE", 0.001))
+
+FEEDBACK_ADMISSION_MAX_LESSONS = int(os.environ.get("FEEDBACK_ADMISSION_MAX_LESSONS", 512))
+
+FRONTEND_BASE_URL = os.environ.get("FRONTEND_BASE_URL", "http://localhost:5173")
+
+# размеры QR-кода в пикселях: по умолчанию, минимум и максимум для ?size=
+QR_DEFAULT_SIZE = int(os.environ.get("QR_DEFAULT_SIZE", 370))
+
+QR_MIN_SIZE = int(os.environ.get("QR_MIN_SIZE", 64))
+
+QR_MAX_SIZE = int(os.environ.get("QR_MAX_SIZE", 2048))
+
+QR_CACHE_MAX_AGE = int(os.environ.get("QR_CACHE_MAX_AGE", 86400))
+
+REPORTS_ROOT = os.environ.get("REPORTS_ROOT", BASE_DIR / 'reports')
+
+# сколько часов хранить готовые отчёты на диске
+REPORT_RETENTION_HOURS = int(os.environ.get("REPORT_RETENTION_HOURS", 24))
+
+# через сколько минут незавершённая задача отчёта считается зависшей
+REPORT_JOB_TIMEOUT_MINUTES = int(os.environ.get("REPORT_JOB_TIMEOUT_MINUTES", 30))
+
+# сколько последних запросов на каждый URL хранить для перцентилей в /api/stats/
+REQUEST_STATS_WINDOW = int(os.environ.get("REQUEST_STATS_WINDOW", 1000))
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subjects', '0002_subject_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='lesson_rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='rated_lesson_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
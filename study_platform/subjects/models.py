@@ -18,6 +18,13 @@ class Subject(models.Model):
         default=0,
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)]
     )
+    lesson_rating_sum = models.FloatField(default=0)
+    rated_lesson_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
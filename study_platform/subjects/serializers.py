@@ -3,13 +3,16 @@ from rest_framework import serializers, generics, filters
 from rest_framework.permissions import IsAuthenticated
 
 from app.permissions import IsTeacherUser
+from lessons.stars import RatingDistributionField
 from .models import Subject
 
 
 class SubjectSerializer(serializers.ModelSerializer):
+    rating_distribution = RatingDistributionField()
+
     class Meta:
         model = Subject
-        fields = ['id', 'name', 'teacher', 'rating']
+        fields = ['id', 'name', 'teacher', 'rating', 'rating_distribution']
         read_only_fields = ['teacher']
 
 